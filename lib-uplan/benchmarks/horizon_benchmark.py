@@ -0,0 +1,59 @@
+"""
+This is supposed to measure what the horizon of the velocity profiler costs in profile quality,
+run it with python benchmarks/horizon_benchmark.py once duckietown_uplan is installed
+"""
+import time
+import numpy as np
+from duckietown_uplan.algo.velocity_profiling import VelocityProfiler, vectorized_cost_function, \
+    get_receding_horizon_profile
+
+
+def benchmark_profile_horizons(horizons, path_length=200, num_paths=10, velocity_min=0.1, velocity_max=0.7,
+                               N=10, vel_start=0.1, cost_function=None, seed=0):
+    """ Compares the profiles of the horizons with the ones of the whole paths, on random paths of
+    smoothly varying uncertainties. Note that the horizon only matters to a cost_function penalizing
+    the velocity changes, the default one does not
+    :return: [(horizon, cost ratio, seconds per profile)] the cost ratio being the total cost of the
+    receding horizon profiles over the one of the optimal profiles, so at least 1, and the first
+    entry is the whole path (horizon None)
+    """
+    random_state = np.random.RandomState(seed)
+    path = [('node%d' % i, {}) for i in range(path_length)]
+    paths_uncertainties = [np.clip(0.5 + np.cumsum(random_state.normal(0, 0.1, path_length)), 0, 1).tolist()
+                           for _ in range(num_paths)]
+    optimal_costs = []
+    cost_matrices = []
+    started = time.time()
+    for uncertainties in paths_uncertainties:
+        velocity_profiler = VelocityProfiler(velocity_min, velocity_max, N)
+        velocity_profiler.get_velocity_profile(vel_start, path, uncertainties, cost_function)
+        optimal_costs.append(sum(velocity_profiler.cost_array))
+        cost_matrices.append(velocity_profiler.cost_matrices)
+    results = [(None, 1., (time.time() - started) / num_paths)]
+    vel_space = np.linspace(velocity_min, velocity_max, N)
+    for horizon in horizons:
+        costs = []
+        num_profiles = 0
+        started = time.time()
+        for uncertainties, path_cost_matrices in zip(paths_uncertainties, cost_matrices):
+            velocity_profiler = VelocityProfiler(velocity_min, velocity_max, N, horizon=horizon)
+            velocities, num_path_profiles = get_receding_horizon_profile(velocity_profiler, vel_start, path,
+                                                                         uncertainties, cost_function)
+            num_profiles += num_path_profiles
+            vel_ids = np.abs(vel_space[np.newaxis, :] - np.array(velocities)[:, np.newaxis]).argmin(axis=1)
+            costs.append(path_cost_matrices[np.arange(len(uncertainties)), vel_ids[:-1], vel_ids[1:]].sum())
+        results.append((horizon, sum(costs) / sum(optimal_costs), (time.time() - started) / num_profiles))
+    return results
+
+
+if __name__ == "__main__":
+    @vectorized_cost_function
+    def smooth_cost_function(delta_v_norm=0, delta_unc=0, unc=0, next_vel_norm=0, error_norm=0):
+        return VelocityProfiler.cost_function(delta_v_norm, delta_unc, unc, next_vel_norm, error_norm) + \
+            2 * delta_v_norm ** 2
+
+    for name, cost_function in [('default', None), ('smooth', smooth_cost_function)]:
+        print('%s cost function' % name)
+        for horizon, cost_ratio, duration in benchmark_profile_horizons([2, 5, 10, 20, 50],
+                                                                        cost_function=cost_function):
+            print('horizon %4s: cost ratio %.4f, %.2f ms per profile' % (horizon, cost_ratio, 1000 * duration))
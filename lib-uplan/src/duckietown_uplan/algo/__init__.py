@@ -1,5 +1,10 @@
 # coding=utf-8
+from .caching import *
 from .constants import *
+from .contraction_hierarchy import *
 from .observations import *
+from .graph_search import *
 from .path_planning import *
+from .planning_pool import *
+from .reservation_table import *
 from .velocity_profiling import *
@@ -0,0 +1,58 @@
+"""
+This is supposed to have the caches shared by the planners of a town
+"""
+__all__ = [
+    'LRUCache',
+]
+
+import collections
+
+
+class LRUCache(object):
+    """ Bounded cache evicting the least recently used entry, with hit and miss counters to size it
+    max_size: maximum number of entries
+    """
+    def __init__(self, max_size=1024):
+        if max_size <= 0:
+            raise ValueError('max_size should be positive, got %s' % max_size)
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # most recently used at the end
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total > 0 else 0.
+
+    def get_stats(self):
+        return {'size': len(self.entries), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.get_hit_rate()}
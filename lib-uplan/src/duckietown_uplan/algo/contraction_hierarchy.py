@@ -0,0 +1,172 @@
+"""
+This is supposed to answer the long distance route queries with a contraction hierarchy
+"""
+__all__ = [
+    'ContractionHierarchy',
+]
+
+import heapq
+import itertools
+import networkx as nx
+
+INF = float('inf')
+
+
+class ContractionHierarchy(object):
+    """ Contraction hierarchy over the unblocked CompactGraph. The nodes are contracted one by one in
+    the order of their edge difference, the shortcuts keep the distances between the remaining ones
+    and a query is a bidirectional Dijkstra going only towards more important nodes
+    compact_graph: CompactGraph, the queries use its node ids
+    max_settled: nodes settled by a witness search before giving up and adding the shortcut
+    """
+    def __init__(self, compact_graph, max_settled=64):
+        self.num_nodes = len(compact_graph)
+        self.max_settled = max_settled
+        # node -> {neighbor: weight}, the shortcuts are added to these while contracting
+        self.out_edges = [{} for _ in range(self.num_nodes)]
+        self.in_edges = [{} for _ in range(self.num_nodes)]
+        # (u, v) -> node bypassed by the shortcut u -> v
+        self.middle_nodes = {}
+        for u, successors in enumerate(compact_graph.get_successor_lists()):
+            for v, weight in successors:
+                if u != v and weight < self.out_edges[u].get(v, INF):
+                    self.out_edges[u][v] = weight
+                    self.in_edges[v][u] = weight
+        self.rank = [0] * self.num_nodes
+        self.num_shortcuts = 0
+        self._contract_all()
+        # upward edges of the forward search and reversed upward edges of the backward search
+        self.up_successors = [[(v, weight) for v, weight in self.out_edges[u].items() if self.rank[v] > self.rank[u]]
+                              for u in range(self.num_nodes)]
+        self.up_predecessors = [[(u, weight) for u, weight in self.in_edges[v].items() if self.rank[u] > self.rank[v]]
+                                for v in range(self.num_nodes)]
+
+    def _get_witness_distances(self, source, excluded, max_dist, contracted):
+        """ Dijkstra from source among the not contracted nodes without excluded, bounded by max_dist """
+        distances = {}
+        counter = itertools.count()
+        queue = [(0, next(counter), source)]
+        while queue and len(distances) < self.max_settled:
+            dist, _, current = heapq.heappop(queue)
+            if current in distances:
+                continue
+            distances[current] = dist
+            if dist > max_dist:
+                break
+            for neighbor, weight in self.out_edges[current].items():
+                if neighbor == excluded or contracted[neighbor] or neighbor in distances:
+                    continue
+                heapq.heappush(queue, (dist + weight, next(counter), neighbor))
+        return distances
+
+    def _get_shortcuts(self, node, contracted):
+        """ Returns the (u, x, weight) shortcuts needed to contract node """
+        shortcuts = []
+        successors = [(x, weight) for x, weight in self.out_edges[node].items() if not contracted[x]]
+        if len(successors) == 0:
+            return shortcuts
+        max_out = max(weight for _, weight in successors)
+        for u, in_weight in self.in_edges[node].items():
+            if contracted[u]:
+                continue
+            witness_distances = self._get_witness_distances(u, node, in_weight + max_out, contracted)
+            for x, out_weight in successors:
+                if x == u:
+                    continue
+                candidate = in_weight + out_weight
+                if witness_distances.get(x, INF) > candidate:
+                    shortcuts.append((u, x, candidate))
+        return shortcuts
+
+    def _get_priority(self, node, contracted, num_contracted_neighbors):
+        num_edges = (sum(1 for u in self.in_edges[node] if not contracted[u]) +
+                     sum(1 for x in self.out_edges[node] if not contracted[x]))
+        return len(self._get_shortcuts(node, contracted)) - num_edges + num_contracted_neighbors[node]
+
+    def _contract_all(self):
+        contracted = [False] * self.num_nodes
+        num_contracted_neighbors = [0] * self.num_nodes
+        queue = [(self._get_priority(node, contracted, num_contracted_neighbors), node)
+                 for node in range(self.num_nodes)]
+        heapq.heapify(queue)
+        current_rank = 0
+        while queue:
+            _, node = heapq.heappop(queue)
+            # lazy update, the priority may have grown since it was pushed
+            priority = self._get_priority(node, contracted, num_contracted_neighbors)
+            if queue and priority > queue[0][0]:
+                heapq.heappush(queue, (priority, node))
+                continue
+            for u, x, weight in self._get_shortcuts(node, contracted):
+                if weight < self.out_edges[u].get(x, INF):
+                    self.out_edges[u][x] = weight
+                    self.in_edges[x][u] = weight
+                    self.middle_nodes[(u, x)] = node
+                    self.num_shortcuts += 1
+            contracted[node] = True
+            self.rank[node] = current_rank
+            current_rank += 1
+            for neighbor in itertools.chain(self.in_edges[node], self.out_edges[node]):
+                num_contracted_neighbors[neighbor] += 1
+
+    def _unpack_edge(self, u, v, path):
+        # iterative, the shortcuts can be nested deeply on long lanes
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            middle = self.middle_nodes.get((a, b))
+            if middle is None:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+    def get_path(self, start, end):
+        """ Returns the node ids of a shortest path from start to end, raises NetworkXNoPath otherwise """
+        if start == end:
+            return [start]
+        distances = ({start: 0}, {end: 0})
+        parents = ({start: None}, {end: None})
+        settled = (set(), set())
+        adjacency = (self.up_successors, self.up_predecessors)
+        counter = itertools.count()
+        queues = ([(0, next(counter), start)], [(0, next(counter), end)])
+        best_dist = INF
+        meeting_node = None
+        while True:
+            tops = [queue[0][0] if queue else INF for queue in queues]
+            side = 0 if tops[0] <= tops[1] else 1
+            if tops[side] >= best_dist:
+                break
+            dist, _, current = heapq.heappop(queues[side])
+            if current in settled[side]:
+                continue
+            settled[side].add(current)
+            other_dist = distances[1 - side].get(current)
+            if other_dist is not None and dist + other_dist < best_dist:
+                best_dist = dist + other_dist
+                meeting_node = current
+            for neighbor, weight in adjacency[side][current]:
+                ncost = dist + weight
+                if ncost < distances[side].get(neighbor, INF):
+                    distances[side][neighbor] = ncost
+                    parents[side][neighbor] = current
+                    heapq.heappush(queues[side], (ncost, next(counter), neighbor))
+                    other_dist = distances[1 - side].get(neighbor)
+                    if other_dist is not None and ncost + other_dist < best_dist:
+                        best_dist = ncost + other_dist
+                        meeting_node = neighbor
+        if meeting_node is None:
+            raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(end, start))
+        up_path = [meeting_node]
+        while parents[0][up_path[-1]] is not None:
+            up_path.append(parents[0][up_path[-1]])
+        up_path.reverse()
+        node = meeting_node
+        while parents[1][node] is not None:
+            up_path.append(parents[1][node])
+            node = parents[1][node]
+        path = [start]
+        for u, v in zip(up_path[:-1], up_path[1:]):
+            self._unpack_edge(u, v, path)
+        return path
@@ -0,0 +1,431 @@
+"""
+This is supposed to have the searches used by the path planner, they run on the integer node ids
+and the plain adjacency lists of a CompactGraph
+"""
+__all__ = [
+    'astar_search',
+    'anytime_astar_search',
+    'space_time_astar_search',
+    'get_dijkstra_paths',
+    'get_distances_from',
+    'LandmarkTable',
+    'DStarLite',
+]
+
+import heapq
+import itertools
+import math
+import time
+import networkx as nx
+import numpy as np
+
+INF = float('inf')
+
+
+def astar_search(successors, start, end, heuristic, blocked_nodes=()):
+    """ A* from start to end
+    successors: list of [(id, weight)] per node, see CompactGraph.get_successor_lists
+    heuristic: function(node_id) giving a lower bound of the distance from the node to end
+    blocked_nodes: ids of the nodes that can not be entered
+    :return: the list of node ids from start to end, raises NetworkXNoPath otherwise
+    """
+    counter = itertools.count()
+    queue = [(heuristic(start), next(counter), start, 0, None)]
+    # node -> (cost, heuristic) of the nodes already in the queue
+    enqueued = {}
+    explored = {}
+    while queue:
+        _, __, current, dist, parent = heapq.heappop(queue)
+        if current == end:
+            path = [current]
+            node = parent
+            while node is not None:
+                path.append(node)
+                node = explored[node]
+            path.reverse()
+            return path
+        if current in explored:
+            # the start node can be reached again through a cycle, keep its parent to None
+            if explored[current] is None:
+                continue
+            qcost, h = enqueued[current]
+            if qcost < dist:
+                continue
+        explored[current] = parent
+        for neighbor, cost in successors[current]:
+            if neighbor in blocked_nodes:
+                continue
+            ncost = dist + cost
+            if neighbor in enqueued:
+                qcost, h = enqueued[neighbor]
+                if qcost <= ncost:
+                    continue
+            else:
+                h = heuristic(neighbor)
+                if h == INF:
+                    # end is not reachable from neighbor
+                    continue
+            enqueued[neighbor] = ncost, h
+            heapq.heappush(queue, (ncost + h, next(counter), neighbor, ncost, current))
+    raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(end, start))
+
+
+def _weighted_astar_search(successors, start, end, heuristic, weight, blocked_nodes, max_cost, deadline):
+    """ A* with the heuristic inflated by weight, the nodes that can not beat max_cost are pruned
+    :return: (cost, path) or None if no path cheaper than max_cost was found before the deadline
+    """
+    counter = itertools.count()
+    queue = [(weight * heuristic(start), next(counter), start, 0, None)]
+    costs = {start: 0}
+    explored = {}
+    while queue:
+        if deadline is not None and next(counter) % 64 == 0 and time.time() > deadline:
+            return None
+        _, __, current, dist, parent = heapq.heappop(queue)
+        if current in explored or dist > costs.get(current, INF):
+            continue
+        explored[current] = parent
+        if current == end:
+            path = [current]
+            while explored[path[-1]] is not None:
+                path.append(explored[path[-1]])
+            path.reverse()
+            return dist, path
+        for neighbor, cost in successors[current]:
+            if neighbor in blocked_nodes or neighbor in explored:
+                continue
+            ncost = dist + cost
+            if ncost >= costs.get(neighbor, INF):
+                continue
+            h = heuristic(neighbor)
+            if ncost + h >= max_cost:
+                continue
+            costs[neighbor] = ncost
+            heapq.heappush(queue, (ncost + weight * h, next(counter), neighbor, ncost, current))
+    return None
+
+
+def anytime_astar_search(successors, start, end, heuristic, deadline, weights=(3., 1.5, 1.), blocked_nodes=()):
+    """ Anytime weighted A*: a first path is found with the most inflated heuristic, then the searches
+    with the next weights look for cheaper paths until the deadline. The first search always finishes,
+    the last weight should be 1 to end with a shortest path
+    heuristic: function(node_id) giving a lower bound of the distance from the node to end
+    deadline: time.time() after which the best path so far is returned
+    :return: (list of node ids from start to end, True if it is a shortest path), raises NetworkXNoPath
+    if there is no path
+    """
+    best = _weighted_astar_search(successors, start, end, heuristic, weights[0], blocked_nodes, INF, None)
+    if best is None:
+        raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(end, start))
+    is_optimal = weights[0] == 1
+    for weight in weights[1:]:
+        if is_optimal or time.time() > deadline:
+            break
+        result = _weighted_astar_search(successors, start, end, heuristic, weight, blocked_nodes, best[0], deadline)
+        if result is None and time.time() > deadline:
+            break
+        if result is not None:
+            best = result
+        # with weight 1 nothing cheaper than best is left
+        is_optimal = weight == 1
+    return best[1], is_optimal
+
+
+def space_time_astar_search(successors, start, end, heuristic, is_reserved, start_time, speed, time_resolution,
+                            end_time, blocked_nodes=(), start_distances=None):
+    """ A* from start to end on the (node, time slot) states, the time at a node being start_time plus
+    the distance travelled at speed. A node is held from its arrival until the arrival at the next node
+    of the path (the end node at its arrival only) and can not be used if it is reserved during that
+    window, so a later (longer) way to reach it can still be used, after end_time the reservations are
+    ignored and the states of a node are merged. These are the windows ReservationTable.reserve takes
+    for the arrival times of the path at speed
+    is_reserved: function(node_id, from_time, to_time) telling if the node is taken by someone else at
+    some time of the window
+    time_resolution: seconds per time slot of the states
+    start_distances: dictionary successor of start -> distance left to it, for a duckie that already
+    left start, the edge weights otherwise. Only the times use it, not the path costs
+    :return: the list of node ids from start to end, raises NetworkXNoPath otherwise
+    """
+    if speed <= 0:
+        raise ValueError('speed should be positive, got %s' % speed)
+    last_slot = int(math.floor((end_time - start_time) / time_resolution)) + 1
+    counter = itertools.count()
+    # (f, tie breaker, node, path cost, arrival time, parent state)
+    queue = [(heuristic(start), next(counter), start, 0, start_time, None)]
+    # (node, slot) -> parent state
+    explored = {}
+    while queue:
+        _, __, current, dist, time, parent = heapq.heappop(queue)
+        state = current, min(int((time - start_time) / time_resolution), last_slot)
+        if state in explored:
+            continue
+        explored[state] = parent
+        if current == end:
+            path = []
+            while state is not None:
+                path.append(state[0])
+                state = explored[state]
+            path.reverse()
+            return path
+        for neighbor, cost in successors[current]:
+            if neighbor in blocked_nodes:
+                continue
+            if current == start and start_distances is not None:
+                arrival_time = time + start_distances.get(neighbor, cost) / speed
+            else:
+                arrival_time = time + cost / speed
+            # is_reserved is the one to ignore the times after end_time, the slot of end_time included
+            if is_reserved(current, time, arrival_time) or \
+                    (neighbor == end and is_reserved(neighbor, arrival_time, arrival_time)):
+                continue
+            h = heuristic(neighbor)
+            if h == INF:
+                continue
+            ncost = dist + cost
+            heapq.heappush(queue, (ncost + h, next(counter), neighbor, ncost, arrival_time, state))
+    raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(end, start))
+
+
+def get_dijkstra_paths(successors, source, targets, blocked_nodes=()):
+    """ One Dijkstra from source for several targets, stopped once they are all reached. The path
+    to a target does not depend on the other targets, so a batch gives the same paths as the single
+    target searches of the 'dijkstra' PathPlanner. Given the successors in the graph order, the ties
+    are broken like in nx.shortest_path: the queue entries are (distance, insertion count, node)
+    successors: list of [(id, weight)] per node, see CompactGraph.get_successor_lists
+    blocked_nodes: ids of the nodes that can not be entered
+    :return: dictionary target -> list of node ids from source, for the reachable targets
+    """
+    remaining = set(targets)
+    parents = {source: None}
+    dist = {}
+    seen = {source: 0}
+    counter = itertools.count()
+    queue = [(0, next(counter), source)]
+    while queue and remaining:
+        d, _, current = heapq.heappop(queue)
+        if current in dist:
+            continue
+        dist[current] = d
+        remaining.discard(current)
+        for neighbor, cost in successors[current]:
+            if neighbor in blocked_nodes or neighbor in dist:
+                continue
+            ncost = d + cost
+            if neighbor not in seen or ncost < seen[neighbor]:
+                seen[neighbor] = ncost
+                parents[neighbor] = current
+                heapq.heappush(queue, (ncost, next(counter), neighbor))
+    paths = {}
+    for target in targets:
+        if target not in dist:
+            continue
+        path = [target]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        path.reverse()
+        paths[target] = path
+    return paths
+
+
+def get_distances_from(adjacency, source):
+    """ Dijkstra distances from source to every node, given the predecessor lists instead of
+    the successor ones these are the distances from every node to source
+    :return: dictionary node_id -> distance of the reachable nodes
+    """
+    distances = {}
+    counter = itertools.count()
+    queue = [(0, next(counter), source)]
+    seen = {source: 0}
+    while queue:
+        dist, _, current = heapq.heappop(queue)
+        if current in distances:
+            continue
+        distances[current] = dist
+        for neighbor, cost in adjacency[current]:
+            ncost = dist + cost
+            if neighbor not in seen or ncost < seen[neighbor]:
+                seen[neighbor] = ncost
+                heapq.heappush(queue, (ncost, next(counter), neighbor))
+    return distances
+
+
+class LandmarkTable(object):
+    """ ALT lower bounds, the distances from and to a few landmarks are computed once and by the
+    triangle inequality d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L). Blocking nodes only
+    makes the paths longer so the bounds stay valid with any occupancy
+    compact_graph: CompactGraph, the bounds are indexed by its node ids
+    num_landmarks: landmarks picked far from each other (farthest point on the node positions)
+    """
+    def __init__(self, compact_graph, num_landmarks=8):
+        num_nodes = len(compact_graph)
+        self.positions = compact_graph.positions
+        self.landmarks = self._select_landmarks(min(num_landmarks, num_nodes))
+        self.from_landmarks = np.full((len(self.landmarks), num_nodes), np.inf)
+        self.to_landmarks = np.full((len(self.landmarks), num_nodes), np.inf)
+        for k, landmark in enumerate(self.landmarks):
+            for node_id, dist in get_distances_from(compact_graph.get_successor_lists(), landmark).items():
+                self.from_landmarks[k, node_id] = dist
+            for node_id, dist in get_distances_from(compact_graph.get_predecessor_lists(), landmark).items():
+                self.to_landmarks[k, node_id] = dist
+
+    def _select_landmarks(self, num_landmarks):
+        if num_landmarks == 0:
+            return []
+        # start from the node farthest from the first one, then always the farthest from the chosen ones
+        landmarks = [int(np.argmax(np.linalg.norm(self.positions - self.positions[0], axis=1)))]
+        min_dists = np.linalg.norm(self.positions - self.positions[landmarks[0]], axis=1)
+        while len(landmarks) < num_landmarks:
+            landmark = int(np.argmax(min_dists))
+            if min_dists[landmark] == 0:
+                break
+            landmarks.append(landmark)
+            min_dists = np.minimum(min_dists, np.linalg.norm(self.positions - self.positions[landmark], axis=1))
+        return landmarks
+
+    def get_lower_bounds(self, end):
+        """ Returns the lower bounds of the distance from every node to end, inf when end can not be reached """
+        with np.errstate(invalid='ignore'):
+            forward = self.from_landmarks[:, end][:, np.newaxis] - self.from_landmarks
+            backward = self.to_landmarks - self.to_landmarks[:, end][:, np.newaxis]
+        # inf - inf, both unreachable, says nothing
+        forward[np.isnan(forward)] = 0
+        backward[np.isnan(backward)] = 0
+        bounds = np.maximum(forward, backward)
+        if len(bounds) == 0:
+            return np.zeros(len(self.positions))
+        return np.maximum(bounds.max(axis=0), 0)
+
+    def get_heuristic(self, end):
+        """ Returns function(node_id) of the lower bound from the node to end """
+        return self.get_lower_bounds(end).tolist().__getitem__
+
+
+class DStarLite(object):
+    """ D* Lite (Koenig and Likhachev) towards a fixed end, the search goes backward from end so the
+    start can move along the path and the blocked nodes can change between two calls, only the
+    nodes whose distance to end is affected by the changes are expanded again
+    successors, predecessors: adjacency lists of the node ids, see CompactGraph.get_successor_lists
+    node_positions: list of (x, y) per node id, the straight line distance is the heuristic
+    """
+    def __init__(self, successors, predecessors, start, end, node_positions, blocked_nodes=None):
+        self.successors = successors
+        self.predecessors = predecessors
+        self.start = start
+        self.end = end
+        self.node_positions = node_positions
+        self.blocked_nodes = set() if blocked_nodes is None else set(blocked_nodes)
+        self.key_modifier = 0
+        self.g = {}
+        self.rhs = {end: 0}
+        self.queue = []
+        # node -> its current key in the queue, the older entries of the heap are skipped when popped
+        self.queued_keys = {}
+        self.counter = itertools.count()
+        self.num_expanded = 0
+        self._push(end, self._get_key(end))
+
+    def _get_heuristic(self, node_1, node_2):
+        x_1, y_1 = self.node_positions[node_1]
+        x_2, y_2 = self.node_positions[node_2]
+        return math.hypot(x_1 - x_2, y_1 - y_2)
+
+    def _get_key(self, node):
+        value = min(self.g.get(node, INF), self.rhs.get(node, INF))
+        return value + self._get_heuristic(self.start, node) + self.key_modifier, value
+
+    def _push(self, node, key):
+        self.queued_keys[node] = key
+        heapq.heappush(self.queue, (key, next(self.counter), node))
+
+    def _get_top_key(self):
+        while self.queue:
+            key, _, node = self.queue[0]
+            if self.queued_keys.get(node) == key:
+                return key
+            heapq.heappop(self.queue)
+        return INF, INF
+
+    def _get_path_cost(self, node):
+        """ Cheapest cost through a successor, the edges going into a blocked node are infinite """
+        best_cost = INF
+        best_successor = None
+        g = self.g
+        blocked_nodes = self.blocked_nodes
+        for successor, cost in self.successors[node]:
+            if successor in blocked_nodes:
+                continue
+            cost += g.get(successor, INF)
+            if cost < best_cost:
+                best_cost = cost
+                best_successor = successor
+        return best_cost, best_successor
+
+    def _update_node(self, node):
+        if node != self.end:
+            self.rhs[node] = self._get_path_cost(node)[0]
+        self.queued_keys.pop(node, None)
+        if self.g.get(node, INF) != self.rhs.get(node, INF):
+            self._push(node, self._get_key(node))
+
+    def _compute_shortest_path(self):
+        while (self._get_top_key() < self._get_key(self.start) or
+               self.rhs.get(self.start, INF) != self.g.get(self.start, INF)):
+            old_key, _, node = heapq.heappop(self.queue)
+            if self.queued_keys.get(node) != old_key:
+                continue
+            del self.queued_keys[node]
+            self.num_expanded += 1
+            new_key = self._get_key(node)
+            if old_key < new_key:
+                self._push(node, new_key)
+            elif self.g.get(node, INF) > self.rhs.get(node, INF):
+                self.g[node] = self.rhs[node]
+                for predecessor, _ in self.predecessors[node]:
+                    self._update_node(predecessor)
+            else:
+                self.g[node] = INF
+                self._update_node(node)
+                for predecessor, _ in self.predecessors[node]:
+                    self._update_node(predecessor)
+
+    def update(self, start, blocked_nodes):
+        """ Moves the start and changes the blocked nodes, the edges going into the nodes that got
+        blocked or unblocked are the changed ones
+        """
+        blocked_nodes = set(blocked_nodes)
+        changed_nodes = self.blocked_nodes ^ blocked_nodes
+        if start != self.start:
+            self.key_modifier += self._get_heuristic(self.start, start)
+            self.start = start
+        self.blocked_nodes = blocked_nodes
+        for node in changed_nodes:
+            for predecessor, _ in self.predecessors[node]:
+                self._update_node(predecessor)
+
+    def get_path(self):
+        """ Returns the list of node ids from start to end, raises NetworkXNoPath otherwise """
+        self._compute_shortest_path()
+        if self.g.get(self.start, INF) == INF:
+            raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(self.end, self.start))
+        # breadth first along the edges of the cheapest successors, with zero weight edges several
+        # successors tie and following any of them greedily can go around a cycle
+        parents = {self.start: None}
+        frontier = [self.start]
+        while frontier and self.end not in parents:
+            next_frontier = []
+            for node in frontier:
+                best_cost = self._get_path_cost(node)[0]
+                for successor, cost in self.successors[node]:
+                    if successor in parents or successor in self.blocked_nodes or \
+                            cost + self.g.get(successor, INF) != best_cost:
+                        continue
+                    parents[successor] = node
+                    next_frontier.append(successor)
+            frontier = next_frontier
+        if self.end not in parents:
+            raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(self.end, self.start))
+        path = [self.end]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
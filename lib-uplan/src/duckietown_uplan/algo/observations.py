@@ -56,5 +56,10 @@ class ObservationModel(object):
         path_uncertainities = [self.curr_uncertainty_values[path_node[0]][1] for path_node in path]
         return path_uncertainities
 
+    def get_changed_uncertainties(self):
+        """ Returns node name -> uncertainty of the nodes whose uncertainty is not the initial one """
+        return dict((key, value[1]) for key, value in self.curr_uncertainty_values.items()
+                    if value[1] != initial_obstacle_prob)
+
     def get_map_uncertainities(self, path):
         return self.curr_uncertainty_values
@@ -5,15 +5,45 @@ __all__ = [
     'PathPlanner',
 ]
 
+import collections
+import hashlib
+import math
 import networkx as nx
+import time
 import numpy as np
 from shapely.geometry import Polygon
 import geometry as geo
-import networkx as nx
-import copy
+from duckietown_uplan.algo.graph_search import astar_search, LandmarkTable, DStarLite, get_dijkstra_paths, \
+    space_time_astar_search, anytime_astar_search
+from duckietown_uplan.algo.contraction_hierarchy import ContractionHierarchy
+from duckietown_uplan.graph_utils.compact_graph import CompactGraph
 
 
 class PathPlanner(object):
+    """ The searches run on a CompactGraph of the graph, the node ids being the indices of
+    node_to_index so that the collision matrix rows are the ids
+    mode: search used by get_shortest_path
+        'dijkstra': Dijkstra, the default. It settles the nodes in the order of nx.shortest_path
+        (successors in the graph order, equal distances in the order they were queued) so among the
+        paths of the same length it picks the same one
+        'astar': A* with the straight line distance to the end, the edge 'dist' being euclidean lengths
+        'alt': A* with the landmark lower bounds of landmark_table (a LandmarkTable shared by the
+        planners of a town), built from the graph when not given
+        'dstar_lite': incremental D* Lite, the search state is kept between the calls with the same end
+        and only repaired around the nodes that got blocked or unblocked, one planner per duckie
+        'ch': contraction_hierarchy query (a ContractionHierarchy shared by the planners of a town,
+        built from the graph when not given), when the route enters a blocked node the masked graph
+        is searched with Dijkstra instead
+    route_cache: optional LRUCache of the routes, keyed by the start, the end and a hash of the
+        blocked nodes, it can be shared by the planners of a town since every mode gives a shortest path
+    compact_graph: CompactGraph shared by the planners of a town, built from graph when not given
+    time_budget: seconds a get_shortest_path search may take, None for no limit. With a budget the
+        path comes from an anytime weighted A* (the heuristic of the mode, the straight line distance
+        for the modes without one) that returns its best path when the budget is over, and
+        is_last_path_optimal tells if it is a shortest path. Only the shortest paths are cached.
+        get_shortest_paths then gives every request the budget of a single search
+    """
+    modes = ('dijkstra', 'astar', 'alt', 'dstar_lite', 'ch')
 
     # def __init__(self, graph):
     #     self.graph = graph
@@ -21,7 +51,8 @@ class PathPlanner(object):
     # length=0.2, width=0.15
     def __init__(self, graph, length=0.1, width=0.05,
                  node_to_index=None, index_to_node=None,
-                 collision_matrix=None):
+                 collision_matrix=None, mode='dijkstra', landmark_table=None, route_cache=None,
+                 compact_graph=None, contraction_hierarchy=None, time_budget=None):
         self.graph = graph
         self.duckie_length = length
         self.duckie_width = width
@@ -31,27 +62,86 @@ class PathPlanner(object):
         self.node_to_index = node_to_index
         self.index_to_node = index_to_node
         self.collision_matrix = collision_matrix
+        if compact_graph is None:
+            node_names = None
+            if index_to_node is not None:
+                node_names = [index_to_node[i] for i in range(len(index_to_node))]
+            compact_graph = CompactGraph(graph, node_names=node_names)
+        self.compact_graph = compact_graph
+        self.route_cache = route_cache
+        self.time_budget = time_budget
+        self.is_last_path_optimal = True
+        self.mode = None
+        self.incremental_search = None
+        self.landmark_table = None
+        self.contraction_hierarchy = None
+        self.set_mode(mode, landmark_table, contraction_hierarchy)
+
+    def set_mode(self, mode, landmark_table=None, contraction_hierarchy=None):
+        if mode not in self.modes:
+            raise ValueError('Unknown planner mode %s, expected one of %s' % (mode, self.modes))
+        if mode == 'alt' and landmark_table is None and self.landmark_table is None:
+            landmark_table = LandmarkTable(self.compact_graph)
+        if mode == 'ch' and contraction_hierarchy is None and self.contraction_hierarchy is None:
+            contraction_hierarchy = ContractionHierarchy(self.compact_graph)
+        self.mode = mode
+        self.incremental_search = None
+        if landmark_table is not None:
+            self.landmark_table = landmark_table
+        if contraction_hierarchy is not None:
+            self.contraction_hierarchy = contraction_hierarchy
+
+    def _get_heuristic(self, end):
+        node_positions = self.compact_graph.get_position_list()
+        end_x, end_y = node_positions[end]
+
+        def euclidean_heuristic(node_id):
+            x, y = node_positions[node_id]
+            return math.hypot(x - end_x, y - end_y)
+        if self.mode != 'alt':
+            return euclidean_heuristic
+        landmark_heuristic = self.landmark_table.get_heuristic(end)
+        return lambda node_id: max(euclidean_heuristic(node_id), landmark_heuristic(node_id))
+
+    def _get_incremental_path(self, start, end, blocked_nodes):
+        if self.incremental_search is None or self.incremental_search.end != end:
+            self.incremental_search = DStarLite(self.compact_graph.get_successor_lists(),
+                                                self.compact_graph.get_predecessor_lists(),
+                                                start, end, self.compact_graph.get_position_list(),
+                                                blocked_nodes=blocked_nodes)
+        else:
+            self.incremental_search.update(start, blocked_nodes)
+        return self.incremental_search.get_path()
 
-    def _build_mod_graph(self, occupancy_vector):
-        forbidden_vector = self.collision_matrix.dot(np.array(occupancy_vector))
-        mod_graph = copy.deepcopy(self.graph)
-        for node_idx in range(len(forbidden_vector)):
-            if forbidden_vector[node_idx] != 0:
-                #HIGE BUG WAS HERE!!
-                forbidden_node_predecessors = list(mod_graph.predecessors(self.index_to_node[node_idx]))
-                for predecessor_node in forbidden_node_predecessors:
-                    #remove edge between the two nodes at all
-                    # mod_graph[predecessor_node][self.index_to_node[node_idx]][0]['dist'] = np.Inf
-                    if len(mod_graph[predecessor_node][self.index_to_node[node_idx]]) > 1:
-                        mod_graph.remove_edge(predecessor_node, self.index_to_node[node_idx])
-                        mod_graph.remove_edge(predecessor_node, self.index_to_node[node_idx])
-                    else:
-                        mod_graph.remove_edge(predecessor_node, self.index_to_node[node_idx])
-                        # mod_graph[predecessor_node][self.index_to_node[node_idx]][1]['dist'] = np.Inf
-                # for successor_node in mod_graph.successors(self.index_to_node[node_idx]):
-                #     mod_graph[self.index_to_node[node_idx]][successor_node][0]['dist'] = np.Inf
-                #     mod_graph[self.index_to_node[node_idx]][successor_node][0]['dist'] = np.Inf
-        return mod_graph
+    def _search(self, start, end, blocked_nodes):
+        """ Returns the node ids from start to end avoiding the blocked ids, raises NetworkXNoPath otherwise """
+        if self.mode == 'ch':
+            # the hierarchy ignores the occupancy, its route stays the shortest one if it avoids it
+            path_node_ids = self.contraction_hierarchy.get_path(start, end)
+            if not any(node_id in blocked_nodes for node_id in path_node_ids[1:]):
+                return path_node_ids
+        if self.mode in ('dijkstra', 'ch'):
+            path_node_ids = get_dijkstra_paths(self.compact_graph.get_successor_lists(), start, [end],
+                                               blocked_nodes=blocked_nodes)
+            if end not in path_node_ids:
+                raise nx.NetworkXNoPath('Node {} not reachable from {}'.format(end, start))
+            return path_node_ids[end]
+        if self.mode == 'dstar_lite':
+            return self._get_incremental_path(start, end, blocked_nodes)
+        return astar_search(self.compact_graph.get_successor_lists(), start, end, self._get_heuristic(end),
+                            blocked_nodes=blocked_nodes)
+
+    def _get_forbidden_indices(self, occupancy_node_names):
+        """ Returns the sorted indices of the nodes colliding with the occupied ones, they can not be entered """
+        from duckietown_uplan.environment.collision import get_colliding_indices
+        occupied_indices = np.array([self.node_to_index[occupied_node_name]
+                                     for occupied_node_name in occupancy_node_names], dtype=int)
+        return get_colliding_indices(self.collision_matrix, occupied_indices)
+
+    @staticmethod
+    def _get_route_key(start, end, forbidden_indices):
+        signature = hashlib.sha1(np.asarray(forbidden_indices, dtype=np.int64).tobytes()).digest()
+        return start, end, signature
 
     def get_shortest_path(self, start, end, occupancy_node_names=[]):
         from duckietown_uplan.environment.utils import get_closest_neighbor
@@ -68,19 +158,147 @@ class PathPlanner(object):
         #occupancy nodes should take care of the footprint of the duckie
         if len(occupancy_node_names) > 0:
             print('hello')
-        occupancy_vector = [0] * len(self.index_to_node)
-
-        for occupied_node_name in occupancy_node_names:
-            occupancy_vector[self.node_to_index[occupied_node_name]] = 1
-        #create occupancy_vector
-        mod_graph = self._build_mod_graph(occupancy_vector)
+        deadline = None if self.time_budget is None else time.time() + self.time_budget
+        self.is_last_path_optimal = True
+        forbidden_indices = self._get_forbidden_indices(occupancy_node_names)
+        if self.route_cache is not None:
+            route_key = self._get_route_key(start, end, forbidden_indices)
+            path_node_names = self.route_cache.get(route_key)
+            if path_node_names is not None:
+                return self._get_path_nodes(path_node_names)
+        start_id, end_id = self.compact_graph.get_id(start), self.compact_graph.get_id(end)
+        blocked_nodes = set(forbidden_indices.tolist())
         try:
-            path_node_names = nx.shortest_path(mod_graph, start, end, weight='dist')
-            path_nodes = [(path_node_name, self.graph.nodes(data=True)[path_node_name])
-                           for path_node_name in path_node_names]
+            if deadline is None:
+                path_node_ids = self._search(start_id, end_id, blocked_nodes)
+            else:
+                path_node_ids, self.is_last_path_optimal = anytime_astar_search(
+                    self.compact_graph.get_successor_lists(), start_id, end_id, self._get_heuristic(end_id),
+                    deadline, blocked_nodes=blocked_nodes)
+            path_node_names = self.compact_graph.get_names(path_node_ids)
         except nx.exception.NetworkXNoPath:
-            return []
+            path_node_names = []
         #getting the cost of the path node and check if any of the nodes has infinity then return and empty path
+        if self.route_cache is not None and self.is_last_path_optimal:
+            self.route_cache.put(route_key, tuple(path_node_names))
+        return self._get_path_nodes(path_node_names)
+
+    def get_cooperative_path(self, start, end, occupancy_node_names, reservation_table, owner, speed,
+                             start_position=None):
+        """ Path from start to end avoiding the occupancy and the slots reserved by the other owners of
+        reservation_table (a ReservationTable), the duckie leaving start now and driving at speed. Every
+        node is free for the window reservation_table.reserve takes for it with these arrival times.
+        The route cache is not used, the reservations change with the time
+        start_position: position of the duckie if it already left start, it drives straight from there
+        to the first node of the path
+        :return: the path like get_shortest_path
+        """
+        blocked_nodes = set(self._get_forbidden_indices(occupancy_node_names).tolist())
+        start_id, end_id = self.compact_graph.get_id(start), self.compact_graph.get_id(end)
+        successors = self.compact_graph.get_successor_lists()
+        node_positions = self.compact_graph.get_position_list()
+        end_x, end_y = node_positions[end_id]
+        start_distances = None
+        if start_position is not None:
+            start_distances = dict((neighbor, math.hypot(node_positions[neighbor][0] - start_position[0],
+                                                         node_positions[neighbor][1] - start_position[1]))
+                                   for neighbor, _ in successors[start_id])
+
+        def euclidean_heuristic(node_id):
+            x, y = node_positions[node_id]
+            return math.hypot(x - end_x, y - end_y)
+
+        def is_reserved(node_id, from_time, to_time):
+            return reservation_table.is_reserved_during(node_id, from_time, to_time, owner)
+        try:
+            path_node_ids = space_time_astar_search(successors, start_id, end_id,
+                                                    euclidean_heuristic, is_reserved,
+                                                    start_time=reservation_table.current_time,
+                                                    speed=speed,
+                                                    time_resolution=reservation_table.slot_duration,
+                                                    end_time=reservation_table.get_end_time(),
+                                                    blocked_nodes=blocked_nodes,
+                                                    start_distances=start_distances)
+        except nx.exception.NetworkXNoPath:
+            path_node_ids = []
+        return self._get_path_nodes(self.compact_graph.get_names(path_node_ids))
+
+    def is_path_blocked(self, path, occupancy_node_names):
+        """ True if a node of path (as returned by get_shortest_path) collides with the occupancy """
+        if len(occupancy_node_names) == 0:
+            return False
+        forbidden_indices = set(self._get_forbidden_indices(occupancy_node_names).tolist())
+        return any(self.node_to_index[path_node_name] in forbidden_indices for path_node_name, _ in path)
+
+    def get_shortest_paths(self, requests):
+        """ Plans several (start, end, occupancy_node_names) requests at once, for example all the
+        duckies of a step. The requests sharing the same occupancy share the blocked nodes, and
+        the ones sharing also the start share a single Dijkstra. With a time_budget the shared
+        searches can not be stopped, every request is planned by get_shortest_path and
+        is_last_path_optimal tells if they are all shortest paths
+        :return: the paths in the order of the requests, each one like get_shortest_path
+        """
+        if self.time_budget is not None:
+            paths = []
+            are_paths_optimal = True
+            for start, end, occupancy_node_names in requests:
+                paths.append(self.get_shortest_path(start, end, occupancy_node_names))
+                are_paths_optimal = are_paths_optimal and self.is_last_path_optimal
+            self.is_last_path_optimal = are_paths_optimal
+            return paths
+        groups = collections.OrderedDict()
+        for request_id, (start, end, occupancy_node_names) in enumerate(requests):
+            groups.setdefault(frozenset(occupancy_node_names), []).append(request_id)
+        paths = [[] for _ in requests]
+        for occupancy_node_names, request_ids in groups.items():
+            forbidden_indices = self._get_forbidden_indices(occupancy_node_names)
+            if self.route_cache is not None:
+                request_ids = self._get_cached_routes(requests, request_ids, forbidden_indices, paths)
+            blocked_nodes = set(forbidden_indices.tolist())
+            if self.mode in ('dijkstra', 'dstar_lite'):
+                # the incremental searches are per duckie, a batch is planned from scratch
+                starts = collections.OrderedDict()
+                for request_id in request_ids:
+                    starts.setdefault(requests[request_id][0], []).append(request_id)
+                for start, start_request_ids in starts.items():
+                    ends = [requests[request_id][1] for request_id in start_request_ids]
+                    path_node_ids = get_dijkstra_paths(self.compact_graph.get_successor_lists(),
+                                                       self.compact_graph.get_id(start),
+                                                       self.compact_graph.get_ids(ends),
+                                                       blocked_nodes=blocked_nodes)
+                    for request_id, end in zip(start_request_ids, ends):
+                        path_node_names = self.compact_graph.get_names(
+                            path_node_ids.get(self.compact_graph.get_id(end), []))
+                        self._set_route(paths, request_id, start, end, forbidden_indices, path_node_names)
+            else:
+                for request_id in request_ids:
+                    start, end, _ = requests[request_id]
+                    try:
+                        path_node_ids = self._search(self.compact_graph.get_id(start), self.compact_graph.get_id(end),
+                                                     blocked_nodes)
+                    except nx.exception.NetworkXNoPath:
+                        path_node_ids = []
+                    self._set_route(paths, request_id, start, end, forbidden_indices,
+                                    self.compact_graph.get_names(path_node_ids))
+        return paths
+
+    def _get_cached_routes(self, requests, request_ids, forbidden_indices, paths):
+        """ Fills paths with the cached routes, returns the requests still to plan """
+        missing_request_ids = []
+        for request_id in request_ids:
+            start, end, _ = requests[request_id]
+            path_node_names = self.route_cache.get(self._get_route_key(start, end, forbidden_indices))
+            if path_node_names is None:
+                missing_request_ids.append(request_id)
+            else:
+                paths[request_id] = self._get_path_nodes(path_node_names)
+        return missing_request_ids
+
+    def _set_route(self, paths, request_id, start, end, forbidden_indices, path_node_names):
+        if self.route_cache is not None:
+            self.route_cache.put(self._get_route_key(start, end, forbidden_indices), tuple(path_node_names))
+        paths[request_id] = self._get_path_nodes(path_node_names)
 
-        path_nodes = path_nodes[1:]
-        return path_nodes
+    def _get_path_nodes(self, path_node_names):
+        # the start is where the duckie already is
+        return [(path_node_name, self.graph.nodes[path_node_name]) for path_node_name in path_node_names[1:]]
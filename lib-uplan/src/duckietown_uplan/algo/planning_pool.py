@@ -0,0 +1,87 @@
+"""
+This class is supposed to run the replans of the duckies of a step on several processes
+"""
+__all__ = [
+    'PlanningPool',
+]
+
+import multiprocessing
+from duckietown_uplan.algo.caching import LRUCache
+from duckietown_uplan.algo.observations import initial_obstacle_prob
+from duckietown_uplan.algo.velocity_profiling import VelocityProfiler
+
+# state of a worker process, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(path_planner):
+    _worker_state['path_planner'] = path_planner
+    _worker_state['velocity_profilers'] = {}
+
+
+def _plan(request):
+    start, end, occupancy_node_names, velocity, profiler_params, cost_function, uncertainties = request
+    path = _worker_state['path_planner'].get_shortest_path(start, end, occupancy_node_names)
+    velocity_profiler = _worker_state['velocity_profilers'].get(profiler_params)
+    if velocity_profiler is None:
+        velocity_min, velocity_max, N, time_budget, horizon, max_velocity_change, profile_cache_size, \
+            uncertainty_resolution = profiler_params
+        # a cache per worker, the one of the caller is not shared between the processes
+        profile_cache = None if profile_cache_size is None else LRUCache(max_size=profile_cache_size)
+        velocity_profiler = VelocityProfiler(velocity_min, velocity_max, N, time_budget=time_budget,
+                                             horizon=horizon, max_velocity_change=max_velocity_change,
+                                             profile_cache=profile_cache,
+                                             uncertainty_resolution=uncertainty_resolution)
+        _worker_state['velocity_profilers'][profiler_params] = velocity_profiler
+    path_uncertainties = [uncertainties.get(path_node_name, initial_obstacle_prob) for path_node_name, _ in path]
+    velocity_profile = velocity_profiler.get_velocity_profile(velocity, path, path_uncertainties, cost_function)
+    # the node data is taken from the graph of the caller, only the names go back
+    return [path_node_name for path_node_name, _ in path], list(velocity_profile)
+
+
+class PlanningPool(object):
+    """ Worker processes planning the path and the velocity profile of replan requests. Every
+    worker holds its own copy of path_planner (graph, collision matrix, compact graph and the
+    shared search tables), read only, so a request only carries what is specific to a duckie.
+    The profilers of the workers have the settings and the cost function of the profilers of the
+    requests, and a profile cache of their own when these have one. The per duckie search state of
+    the 'dstar_lite' planners is not available to the workers, see DuckieTown.set_parallel_planning
+    path_planner: PathPlanner copied to the workers when they start
+    processes: number of workers, defaults to the number of cores
+    """
+    def __init__(self, path_planner, processes=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                         initargs=(path_planner,))
+
+    @staticmethod
+    def get_request(start, end, occupancy_node_names, velocity, velocity_profiler, observation_model):
+        """ Request of a replan from start to end, the uncertainties are sent only where they
+        moved away from their initial value. A cost function set on velocity_profiler is sent too,
+        so it has to be picklable (e.g. defined at the top level of a module)
+        """
+        profile_cache = velocity_profiler.profile_cache
+        profiler_params = (velocity_profiler.velocity_min, velocity_profiler.velocity_max, velocity_profiler.N,
+                           velocity_profiler.time_budget, velocity_profiler.horizon,
+                           velocity_profiler.max_velocity_change,
+                           None if profile_cache is None else profile_cache.max_size,
+                           velocity_profiler.uncertainty_resolution)
+        # the default one is known to the workers
+        cost_function = velocity_profiler.cost_function
+        if cost_function is VelocityProfiler.cost_function:
+            cost_function = None
+        return (start, end, list(occupancy_node_names), velocity, profiler_params, cost_function,
+                observation_model.get_changed_uncertainties())
+
+    def plan(self, requests):
+        """ Returns the (path node names, velocity profile) of the requests, in their order """
+        if len(requests) == 0:
+            return []
+        chunk_size = max(1, len(requests) // (4 * self.processes))
+        return self.pool.map(_plan, requests, chunksize=chunk_size)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,126 @@
+"""
+This class is supposed to keep the space-time slots reserved by the planned paths of a town
+"""
+__all__ = [
+    'ReservationTable',
+]
+
+import collections
+import math
+
+
+class ReservationTable(object):
+    """ Shared (node id, time slot) reservations of the cooperative planning. A duckie reserves the
+    nodes of its path for the time windows given by its velocity profile, and since two duckies
+    collide as soon as their nodes collide every reservation also covers the colliding nodes of the
+    collision matrix, so a check is a single lookup
+    collision_matrix: csr collision matrix of the node ids, see build_collision_matrix
+    slot_duration: seconds per time slot
+    horizon: seconds ahead of current_time that are reserved, the rest of a path is free
+    """
+    def __init__(self, collision_matrix, slot_duration=0.2, horizon=10.):
+        if slot_duration <= 0:
+            raise ValueError('slot_duration should be positive, got %s' % slot_duration)
+        self.collision_matrix = collision_matrix
+        self.slot_duration = slot_duration
+        self.horizon = horizon
+        self.current_time = 0.
+        # slot -> node id -> owners
+        self.slots = collections.defaultdict(dict)
+        # owner -> [(slot, node id)] of its reservations
+        self.owner_reservations = collections.defaultdict(list)
+
+    def __len__(self):
+        return sum(len(reserved_nodes) for reserved_nodes in self.slots.values())
+
+    def get_slot(self, time):
+        return int(math.floor(time / self.slot_duration))
+
+    def get_end_time(self):
+        return self.current_time + self.horizon
+
+    def get_windows(self, node_ids, arrival_times):
+        """ Yields the (node id, first slot, last slot) taken by a path: node_ids[k] is held from
+        arrival_times[k] until arrival_times[k + 1], the last node for its arrival slot only. The
+        windows are clipped to the horizon, the ones outside of it are skipped
+        """
+        first_slot = self.get_slot(self.current_time)
+        last_slot = self.get_slot(self.get_end_time())
+        for k, node_id in enumerate(node_ids):
+            start_slot = max(self.get_slot(arrival_times[k]), first_slot)
+            end_slot = start_slot
+            if k + 1 < len(node_ids):
+                end_slot = self.get_slot(arrival_times[k + 1])
+            end_slot = min(end_slot, last_slot)
+            if start_slot <= end_slot:
+                yield node_id, start_slot, end_slot
+
+    def reserve(self, owner, node_ids, arrival_times):
+        """ Reserves the windows of the path, see get_windows """
+        indptr = self.collision_matrix.indptr
+        indices = self.collision_matrix.indices
+        reservations = self.owner_reservations[owner]
+        for node_id, start_slot, end_slot in self.get_windows(node_ids, arrival_times):
+            colliding_ids = indices[indptr[node_id]:indptr[node_id + 1]].tolist()
+            for slot in range(start_slot, end_slot + 1):
+                reserved_nodes = self.slots[slot]
+                for colliding_id in colliding_ids:
+                    reserved_nodes.setdefault(colliding_id, set()).add(owner)
+                    reservations.append((slot, colliding_id))
+
+    def release(self, owner):
+        """ Removes all the reservations of owner, before it plans again """
+        for slot, node_id in self.owner_reservations.pop(owner, []):
+            reserved_nodes = self.slots.get(slot)
+            if reserved_nodes is None or node_id not in reserved_nodes:
+                continue
+            reserved_nodes[node_id].discard(owner)
+            if len(reserved_nodes[node_id]) == 0:
+                del reserved_nodes[node_id]
+
+    def _is_slot_reserved(self, node_id, slot, owner):
+        reserved_nodes = self.slots.get(slot)
+        if reserved_nodes is None:
+            return False
+        owners = reserved_nodes.get(node_id)
+        if not owners:
+            return False
+        return len(owners) > 1 or owner not in owners
+
+    def is_reserved(self, node_id, time, owner=None):
+        """ True if another owner than owner holds node_id (or a node colliding with it) at time """
+        return self._is_slot_reserved(node_id, self.get_slot(time), owner)
+
+    def is_reserved_during(self, node_id, start_time, end_time, owner=None):
+        """ True if another owner than owner holds node_id at some time of [start_time, end_time],
+        that is in one of the slots reserve would take for it
+        """
+        start_slot = max(self.get_slot(start_time), self.get_slot(self.current_time))
+        end_slot = min(self.get_slot(end_time), self.get_slot(self.get_end_time()))
+        return any(self._is_slot_reserved(node_id, slot, owner) for slot in range(start_slot, end_slot + 1))
+
+    def is_path_reserved(self, node_ids, arrival_times, owner=None):
+        """ True if another owner than owner holds one of the windows of the path, see get_windows """
+        for node_id, start_slot, end_slot in self.get_windows(node_ids, arrival_times):
+            for slot in range(start_slot, end_slot + 1):
+                if self._is_slot_reserved(node_id, slot, owner):
+                    return True
+        return False
+
+    def advance(self, time_in_seconds):
+        """ Moves current_time forward and forgets the slots that are over """
+        self.current_time += time_in_seconds
+        current_slot = self.get_slot(self.current_time)
+        for slot in [slot for slot in self.slots if slot < current_slot]:
+            del self.slots[slot]
+        for owner in list(self.owner_reservations):
+            reservations = [reservation for reservation in self.owner_reservations[owner]
+                            if reservation[0] >= current_slot]
+            if reservations:
+                self.owner_reservations[owner] = reservations
+            else:
+                del self.owner_reservations[owner]
+
+    def clear(self):
+        self.slots.clear()
+        self.owner_reservations.clear()
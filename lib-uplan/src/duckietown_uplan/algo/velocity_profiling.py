@@ -1,110 +1,376 @@
 """
 This class is supposed to take care of everything for getting the velocity profiler plan
 """
-import networkx as nx
+import hashlib
+import time
 import numpy as np
 
 
 __all__ = [
     'VelocityProfiler',
+    'CostToGoTables',
+    'vectorized_cost_function',
+    'get_vectorized_cost_function',
+    'get_receding_horizon_profile',
 ]
 
+
+def vectorized_cost_function(function):
+    """ Marks function as a cost function of all the edges of the velocity graph at once. It is called
+    with arrays broadcasting to (path nodes - 1, N, N), the edges from the path node i with the
+    velocity j to the path node i + 1 with the velocity k:
+        delta_v_norm (1, N, N), delta_unc (path nodes - 1, 1, 1), unc (path nodes - 1, 1, 1),
+        next_vel_norm (1, 1, N), error_norm (1, 1, N)
+    and returns the costs, broadcasting to the same shape. With a band of velocity changes (see
+    CostToGoTables) k is the k-th next velocity of the band of j instead, and the shapes of
+    next_vel_norm and error_norm are (1, N, band size)
+    """
+    function.vectorized = True
+    return function
+
+
+def get_vectorized_cost_function(cost_function):
+    """ Returns cost_function if it is vectorized, otherwise an adapter calling it edge by edge with
+    the scalars of the arrays
+    """
+    if getattr(cost_function, 'vectorized', False):
+        return cost_function
+
+    @vectorized_cost_function
+    def scalar_cost_function(delta_v_norm, delta_unc, unc, next_vel_norm, error_norm):
+        arrays = np.broadcast_arrays(delta_v_norm, delta_unc, unc, next_vel_norm, error_norm)
+        costs = np.empty(arrays[0].shape)
+        for index in np.ndindex(*costs.shape):
+            costs[index] = cost_function(delta_v_norm=arrays[0][index],
+                                         delta_unc=arrays[1][index],
+                                         unc=arrays[2][index],
+                                         next_vel_norm=arrays[3][index],
+                                         error_norm=arrays[4][index])
+        return costs
+    return scalar_cost_function
+
+
+class CostToGoTables(object):
+    """ Backward dynamic programming tables of a VelocityProfiler for one velocity discretization: the
+    cheapest cost from every (path node, velocity) to the end of the path and the next velocity
+    reaching it. The layers only depend on the uncertainties of their two path nodes, so the tables
+    are indexed from the end of the path and the ones of the suffix shared with the previous path
+    (usually the same path without its first node) are kept, only the new first layers are computed
+    cost_function: see vectorized_cost_function, a scalar one is called edge by edge
+    vel_space: the velocities
+    band_width: number of velocities the velocity may move up or down between two path nodes, None for
+    any change. The layers only hold the N * (2 * band_width + 1) edges of the band, [from velocity id,
+    next velocity id - from velocity id + band_width], the ones leaving vel_space costing inf
+    The costs to go of the last path node are zeros, or terminal_costs for a profile stopping at a horizon
+    """
+    def __init__(self, cost_function, vel_space, velocity_min, velocity_max, band_width=None):
+        self.cost_function = cost_function
+        self.vectorized_cost_function = get_vectorized_cost_function(cost_function)
+        self.vel_space = vel_space
+        self.velocity_min = velocity_min
+        self.velocity_max = velocity_max
+        self.band_width = band_width
+        N = len(vel_space)
+        # next velocity id of every edge of a layer, clipped to vel_space, and the edges staying in it
+        if band_width is None:
+            self.next_vel_ids = np.arange(N)[np.newaxis, :]
+            self.valid_edges = None
+        else:
+            next_vel_ids = np.arange(N)[:, np.newaxis] + np.arange(-band_width, band_width + 1)[np.newaxis, :]
+            self.valid_edges = (next_vel_ids >= 0) & (next_vel_ids < N)
+            self.next_vel_ids = np.clip(next_vel_ids, 0, N - 1)
+        self.uncertainties = np.zeros(0)
+        self.terminal_costs = np.zeros(len(vel_space))
+        # [r]: the layer going into the r-th path node before the last one
+        self.cost_matrices = []
+        # [r]: the r-th path node before the last one
+        self.costs_to_go = [self.terminal_costs]
+        self.best_next_vel_ids = [None]
+        self.num_computed_layers = 0
+
+    def __len__(self):
+        return len(self.uncertainties)
+
+    def get_layer_costs(self, uncertainties):
+        """ Returns the (len(uncertainties) - 1, N, N) costs of the layers between the path nodes
+        with these uncertainties, [i][from velocity id, to velocity id], or (len(uncertainties) - 1,
+        N, band size) with a band_width
+        """
+        N = len(self.vel_space)
+        # axes: (path node, from velocity, to velocity)
+        start_vel = self.vel_space[np.newaxis, :, np.newaxis]
+        next_vel = self.vel_space[self.next_vel_ids][np.newaxis]
+        # the edge i -> i + 1 is charged the change of velocity, the gap of the next velocity to the
+        # top speed (both over the velocity range) and the uncertainty of node i + 1 it drives into
+        delta_v = np.abs(start_vel - next_vel)
+        delta_v_norm = delta_v/(self.velocity_max - self.velocity_min)
+        delta_unc = np.abs(uncertainties[:-1] - uncertainties[1:])[:, np.newaxis, np.newaxis]
+        ref = self.velocity_max
+        error = abs(ref - next_vel)
+        error_norm = error/(self.velocity_max - self.velocity_min)
+
+        next_vel_norm = (next_vel-self.velocity_min)/(self.velocity_max - self.velocity_min)
+
+        costs = self.vectorized_cost_function(delta_v_norm=delta_v_norm,
+                                              delta_unc=delta_unc,
+                                              unc=uncertainties[1:, np.newaxis, np.newaxis],
+                                              next_vel_norm=next_vel_norm,
+                                              error_norm=error_norm)
+        costs = np.array(np.broadcast_to(costs, (len(uncertainties) - 1, N, self.next_vel_ids.shape[1])),
+                         dtype=float)
+        if self.valid_edges is not None:
+            costs[:, ~self.valid_edges] = np.inf
+        return costs
+
+    def get_costs_to_go(self, cost_matrix, next_costs_to_go):
+        """ Returns (costs to go, best next velocity ids) of the velocities of a path node, from the
+        costs of its layer and the costs to go of the next path node
+        """
+        path_costs = cost_matrix + next_costs_to_go[self.next_vel_ids]
+        best_edges = np.argmin(path_costs, axis=1)
+        vel_ids = np.arange(len(best_edges))
+        best_next_vel_ids = np.broadcast_to(self.next_vel_ids, path_costs.shape)[vel_ids, best_edges]
+        return path_costs[vel_ids, best_edges], best_next_vel_ids
+
+    def get_stationary_costs_to_go(self, uncertainty, num_layers):
+        """ Returns the costs to go of num_layers layers between path nodes of the same uncertainty,
+        the terminal costs approximating the rest of a path beyond a horizon
+        """
+        cost_matrix = self.get_layer_costs(np.array([uncertainty, uncertainty]))[0]
+        costs_to_go = np.zeros(len(self.vel_space))
+        for _ in range(num_layers):
+            costs_to_go, _ = self.get_costs_to_go(cost_matrix, costs_to_go)
+        return costs_to_go
+
+    def update(self, uncertainties, terminal_costs=None):
+        """ Moves the tables to a path with these uncertainties, the first one being the start
+        terminal_costs: costs to go of the velocities of the last path node, zeros by default. The
+        whole tables are computed again when they change
+        """
+        uncertainties = np.asarray(uncertainties, dtype=float)
+        if terminal_costs is None:
+            terminal_costs = np.zeros(len(self.vel_space))
+        if not np.array_equal(terminal_costs, self.terminal_costs):
+            self.terminal_costs = np.asarray(terminal_costs, dtype=float)
+            self.uncertainties = np.zeros(0)
+            self.costs_to_go = [self.terminal_costs]
+        num_compared = min(len(uncertainties), len(self.uncertainties))
+        mismatches = np.flatnonzero(uncertainties[len(uncertainties) - num_compared:][::-1] !=
+                                    self.uncertainties[len(self.uncertainties) - num_compared:][::-1])
+        num_shared_nodes = mismatches[0] if len(mismatches) > 0 else num_compared
+        num_kept_layers = max(num_shared_nodes - 1, 0)
+        del self.cost_matrices[num_kept_layers:]
+        del self.costs_to_go[num_kept_layers + 1:]
+        del self.best_next_vel_ids[num_kept_layers + 1:]
+        layer_costs = self.get_layer_costs(uncertainties[:len(uncertainties) - num_kept_layers])
+        for cost_matrix in layer_costs[::-1]:
+            costs_to_go, best_next_vel_ids = self.get_costs_to_go(cost_matrix, self.costs_to_go[-1])
+            self.cost_matrices.append(cost_matrix)
+            self.costs_to_go.append(costs_to_go)
+            self.best_next_vel_ids.append(best_next_vel_ids)
+        self.num_computed_layers = len(layer_costs)
+        self.uncertainties = uncertainties
+
+    def get_cost_matrix(self, layer_id):
+        """ (N, N) costs of the layer from the path node layer_id to layer_id + 1, inf outside the band """
+        cost_matrix = self.cost_matrices[len(self.uncertainties) - 2 - layer_id]
+        if self.valid_edges is None:
+            return cost_matrix
+        full_cost_matrix = np.full((len(self.vel_space), len(self.vel_space)), np.inf)
+        from_vel_ids = np.broadcast_to(np.arange(len(self.vel_space))[:, np.newaxis], self.next_vel_ids.shape)
+        full_cost_matrix[from_vel_ids[self.valid_edges], self.next_vel_ids[self.valid_edges]] = \
+            cost_matrix[self.valid_edges]
+        return full_cost_matrix
+
+    def get_edge_cost(self, layer_id, from_vel_id, to_vel_id):
+        """ Cost of the edge of the layer from the path node layer_id to layer_id + 1 """
+        cost_matrix = self.cost_matrices[len(self.uncertainties) - 2 - layer_id]
+        if self.band_width is None:
+            return cost_matrix[from_vel_id, to_vel_id]
+        if abs(to_vel_id - from_vel_id) > self.band_width:
+            return np.inf
+        return cost_matrix[from_vel_id, to_vel_id - from_vel_id + self.band_width]
+
+    def get_min_path(self, id_start):
+        """ Returns the cheapest [(path node id, velocity id)] from the start velocity id """
+        path = [(0, id_start)]
+        vel_id = id_start
+        for path_id in range(1, len(self.uncertainties)):
+            vel_id = int(self.best_next_vel_ids[len(self.uncertainties) - path_id][vel_id])
+            path.append((path_id, vel_id))
+        return path
+
+
 class VelocityProfiler(object):
-    def __init__(self, velocity_min, velocity_max, N):
+    """ The profile is the cheapest path in the layered graph of the (path node, velocity), computed
+    backward from the end of the path. The CostToGoTables are kept between the calls, when the duckie
+    moves along its path only the layers of the new first nodes are computed. Only the winning
+    profile is built, path_history and trajectory_history (the cheapest path to every end velocity,
+    for debugging and plotting) are computed the first time they are read after a profile
+    time_budget: seconds get_velocity_profile may take, None for no limit. With a budget the
+    profile is first computed with a coarse velocity discretization, refined while the finer one is
+    expected to fit in the budget, and is_last_profile_optimal tells if the N velocities were used
+    horizon: number of path nodes profiled, None for the whole path. Beyond it the rest of the path
+    is approximated by a terminal cost, the profile keeps the last optimized velocity there and
+    num_profiled_velocities tells how many of its velocities were optimized, the caller profiling
+    again from where they run out
+    max_velocity_change: largest change of velocity between two path nodes (the acceleration the
+    duckie can make over a lattice edge), None for any change. Only the band of the velocities it
+    reaches is connected, at least the neighboring ones, so the layers have N * band size edges
+    instead of N ** 2 and finer discretizations cost the same
+    profile_cache: optional LRUCache of the profiles, keyed by the settings of the profiler, the start
+    velocity bin, the path length and the uncertainties quantized to uncertainty_resolution, it can be
+    shared by the profilers of a town. A hit returns the profile of a path with the same quantized
+    uncertainties without computing anything, the tables and the histories of that profile are only
+    built again, from the uncertainties it was computed for, when they are read
+    """
+    def __init__(self, velocity_min, velocity_max, N, time_budget=None, horizon=None, max_velocity_change=None,
+                 profile_cache=None, uncertainty_resolution=0.01):
+        if horizon is not None and horizon < 1:
+            raise ValueError('horizon should be at least 1, got %s' % horizon)
+        if max_velocity_change is not None and max_velocity_change <= 0:
+            raise ValueError('max_velocity_change should be positive, got %s' % max_velocity_change)
         self.velocity_min = velocity_min
         self.velocity_max = velocity_max
         self.N = N
-        self.vel_graph = None
+        self.time_budget = time_budget
+        self.horizon = horizon
+        self.max_velocity_change = max_velocity_change
+        self.profile_cache = profile_cache
+        self.uncertainty_resolution = uncertainty_resolution
+        self.is_last_profile_optimal = True
+        self.num_profiled_velocities = 0
+        # number of velocities -> CostToGoTables
+        self.cost_to_go_tables = {}
+        # (cost function, uncertainties) of the cached profile returned last, see tables
+        self._cached_profile_args = None
+        self.tables = None
+        self.vel_start = None
         self.vel_ids = None
         self.vel_space = None
         self.path_ids = None
-        self.path_history = None
-        self.trajectory_history = None
         self.uncertainties = []
         self.cost_array = []
         self.additive_cost_array = []
-
-    def generate_velocity_graph(self, path, cost_function=None):
-
-        self.vel_graph = nx.DiGraph()
-        self.vel_space = np.linspace(self.velocity_min, self.velocity_max, self.N)
-        self.vel_ids = range(len(self.vel_space))
-        self.path_ids = range(len(path))
-        uncertainties = self.uncertainties # TODO erase this toy example
-
-        for node in self.path_ids:
-            for vel_id in self.vel_ids:
-                self.vel_graph.add_node((node, vel_id))
-
-        for i, pose_id in enumerate(self.path_ids[:-1]):
-            for j in self.vel_ids:
-                from_node = (self.path_ids[i], self.vel_ids[j])
-                for k in self.vel_ids:
-                    to_node = (self.path_ids[i + 1], self.vel_ids[k])
-                    start_vel = self.vel_space[self.vel_ids[j]]
-                    next_vel = self.vel_space[self.vel_ids[k]]
-
-                    # TODO: check logic of
-                    delta_v = np.abs(start_vel - next_vel)
-                    delta_v_norm = delta_v/(self.velocity_max - self.velocity_min)
-                    delta_unc = np.abs(uncertainties[i] - uncertainties[i+1])
-                    ref = self.velocity_max
-                    error = abs(ref - next_vel)
-                    error_norm = error/(self.velocity_max - self.velocity_min)
-
-                    # Penalizing huge changes in velocity
-                    #if abs(self.vel_ids[j] - self.vel_ids[k]) > 1:
-                    #    delta_v_norm = np.Inf
-
-                    next_vel_norm = (next_vel-self.velocity_min)/(self.velocity_max - self.velocity_min)
-
-                    # Just for testing
-                    if cost_function is None:
-                        cost = self.cost_function(delta_v_norm=delta_v_norm,
-                                                  delta_unc=delta_unc,
-                                                  unc=uncertainties[i+1],
-                                                  next_vel_norm=next_vel_norm,
-                                                  error_norm=error_norm)
-                    else:
-                        cost = cost_function(delta_v_norm=delta_v_norm,
-                                             delta_unc=delta_unc,
-                                             unc=uncertainties[i+1],
-                                             next_vel_norm=next_vel_norm,
-                                             error_norm=error_norm)
-
-                    self.vel_graph.add_edge(from_node, to_node, cost=cost)
-        return self.vel_graph
-
-    def get_astar_path(self, vel_start, vel_end):
-        # vel_0 and v_end are indices in the discretized velocity space (could )
+        self._path_history = None
+        self._trajectory_history = None
+        self._min_vel_ids = None
+
+    @property
+    def tables(self):
+        """ CostToGoTables of the last profile """
+        if self._tables is None and self._cached_profile_args is not None:
+            cost_function, uncertainties = self._cached_profile_args
+            self._tables = self._update_tables(cost_function, self.N, uncertainties, len(self.uncertainties) - 1)
+            self._cached_profile_args = None
+        return self._tables
+
+    @tables.setter
+    def tables(self, tables):
+        self._tables = tables
+        self._cached_profile_args = None
+
+    @property
+    def cost_matrices(self):
+        """ (path nodes - 1, N, N) costs of the layers of the last profile """
+        if self.tables is None:
+            return None
+        return np.array([self.tables.get_cost_matrix(layer_id) for layer_id in range(len(self.tables) - 1)])
+
+    @property
+    def path_history(self):
+        """ [(cost, path)] of the cheapest path to every end velocity of the last profile """
+        if self._path_history is None and self.tables is not None:
+            costs, vel_ids = self._get_min_vel_ids()
+            self._path_history = [(cost, list(zip(self.path_ids, path_vel_ids)))
+                                  for cost, path_vel_ids in zip(costs, vel_ids.tolist())]
+        return self._path_history
+
+    @property
+    def trajectory_history(self):
+        """ [(cost, trajectory)] of the cheapest path to every end velocity of the last profile """
+        if self._trajectory_history is None and self.tables is not None:
+            costs, vel_ids = self._get_min_vel_ids()
+            self._trajectory_history = [(cost, list(trajectory))
+                                        for cost, trajectory in zip(costs, self.vel_space[vel_ids])]
+        return self._trajectory_history
+
+    def _get_min_vel_ids(self):
+        # shared by the two histories, nothing of them is built by get_velocity_profile
+        if self._min_vel_ids is None:
+            self._min_vel_ids = self.get_min_vel_ids(self.vel_start)
+        return self._min_vel_ids
+
+    def get_tables(self, cost_function=None, N=None):
+        """ Returns the CostToGoTables of N velocities for cost_function, new ones if it changed
+        cost_function: see vectorized_cost_function, a scalar one is called edge by edge
+        N: number of velocities, defaults to self.N
+        """
+        if N is None:
+            N = self.N
+        if cost_function is None:
+            cost_function = self.cost_function
+        band_width = self.get_band_width(N)
+        tables = self.cost_to_go_tables.get(N)
+        if tables is None or tables.cost_function != cost_function or tables.band_width != band_width or \
+                (tables.velocity_min, tables.velocity_max) != (self.velocity_min, self.velocity_max):
+            tables = CostToGoTables(cost_function,
+                                    np.linspace(self.velocity_min, self.velocity_max, N),
+                                    self.velocity_min, self.velocity_max,
+                                    band_width=band_width)
+            self.cost_to_go_tables[N] = tables
+        return tables
+
+    def get_band_width(self, N):
+        """ Number of velocities of N the velocity may move up or down between two path nodes with
+        max_velocity_change, at least 1, None when it reaches all of them
+        """
+        if self.max_velocity_change is None or N < 2:
+            return None
+        velocity_step = float(self.velocity_max - self.velocity_min) / (N - 1)
+        band_width = max(1, int(np.floor(self.max_velocity_change / velocity_step + 1e-9)))
+        if band_width >= N - 1:
+            return None
+        return band_width
+
+    def get_min_vel_ids(self, vel_start):
+        """ Forward dynamic programming over the layers, the cheapest path from the start velocity to
+        every velocity of the last path node at once. A velocity takes as parent the cheapest one of
+        the previous layer, the ties going to the one a Dijkstra on the velocity graph would settle
+        first: the cheapest so far, then the one whose own parent was settled first, then the lowest id
+        :return: (costs, vel_ids) the cost of the cheapest path to every end velocity id, summed like
+        get_path_cost, and the (N, path nodes) velocity ids of these paths
+        """
         id_start = np.abs(self.vel_space - vel_start).argmin()
-        id_end = np.abs(self.vel_space - vel_end).argmin()
-
-        start = (self.path_ids[0], id_start)
-        end = (self.path_ids[-1], id_end)
-
-        return nx.astar_path(self.vel_graph, start, end, heuristic=None, weight='cost')
-
-    def get_min_path(self, vel_start):
-        min_path_cost = np.Inf
-        min_path = []
-        path_history = []
-        self.cost_array = []
-        self.additive_cost_array = []
-        for end_vel_id in self.vel_ids:
-            path = self.get_astar_path(vel_start, self.vel_space[end_vel_id])
-            path_cost, cost_array, additive_cost_array = self.get_path_cost(path)
-            path_history.append((path_cost, path))
-
-            if path_cost < min_path_cost:
-                min_path_cost = path_cost
-                min_path = path
-                self.cost_array = cost_array
-                self.additive_cost_array = additive_cost_array
-
-        if min_path == np.Inf:
-            raise ValueError("No feasable velocity path")
-        return min_path, min_path_cost, path_history
+        num_velocities = len(self.vel_ids)
+        costs = np.full(num_velocities, np.inf)
+        costs[id_start] = 0
+        # velocity ids of the layer in the order they are settled
+        settle_order = np.array([id_start])
+        parents = []
+        for layer_id in range(len(self.tables) - 1):
+            cost_matrix = self.tables.get_cost_matrix(layer_id)
+            # rows in settle order, so argmin picks the first settled one among the cheapest
+            path_costs = costs[settle_order][:, np.newaxis] + cost_matrix[settle_order]
+            best_rows = np.argmin(path_costs, axis=0)
+            layer_parents = settle_order[best_rows]
+            costs = path_costs[best_rows, np.arange(num_velocities)]
+            # lexsort uses the last key first
+            settle_order = np.lexsort((np.arange(num_velocities), best_rows, costs))
+            parents.append(layer_parents)
+        # all the end velocities are backtracked together
+        vel_ids = np.empty((num_velocities, len(self.path_ids)), dtype=int)
+        vel_ids[:, -1] = np.arange(num_velocities)
+        for path_id in reversed(self.path_ids[:-1]):
+            vel_ids[:, path_id] = parents[path_id][vel_ids[:, path_id + 1]]
+        return costs, vel_ids
+
+    def get_min_paths(self, vel_start):
+        """ Returns the list of the cheapest paths [(path node id, velocity id)] per end velocity id,
+        see get_min_vel_ids
+        """
+        _, vel_ids = self.get_min_vel_ids(vel_start)
+        return [list(zip(self.path_ids, path_vel_ids)) for path_vel_ids in vel_ids.tolist()]
 
     def get_path_cost(self, path):
         additive_cost = 0
@@ -112,32 +378,126 @@ class VelocityProfiler(object):
         additive_cost_array = []
         for k, node in enumerate(path[:-1]):
             additive_cost_array.append(additive_cost)
-            cost_array.append(self.vel_graph[path[k]][path[k+1]]["cost"])
+            cost_array.append(self.tables.get_edge_cost(k, path[k][1], path[k+1][1]))
             additive_cost += cost_array[-1]
 
         return additive_cost, cost_array, additive_cost_array
 
+    def get_profile_key(self, vel_start, path_length, uncertainties, cost_function=None):
+        """ Key of a profile in profile_cache """
+        if cost_function is None:
+            cost_function = self.cost_function
+        vel_start_id = int(np.abs(np.linspace(self.velocity_min, self.velocity_max, self.N) - vel_start).argmin())
+        quantized_uncertainties = np.round(np.asarray(uncertainties, dtype=float) / self.uncertainty_resolution)
+        signature = hashlib.sha1(quantized_uncertainties.astype(np.int64).tobytes()).digest()
+        return (cost_function, self.velocity_min, self.velocity_max, self.N, self.horizon,
+                self.get_band_width(self.N), vel_start_id, path_length, signature)
+
     def get_velocity_profile(self, vel_start, old_path, uncertainties, cost_function=None):
+        if self.profile_cache is None or len(old_path) == 0:
+            return self._get_uncached_velocity_profile(vel_start, old_path, uncertainties, cost_function)
+        profile_key = self.get_profile_key(vel_start, len(old_path), uncertainties, cost_function)
+        cached_profile = self.profile_cache.get(profile_key)
+        if cached_profile is not None:
+            velocity_profile, self.cost_array, self.additive_cost_array, self.num_profiled_velocities, \
+                cached_uncertainties = cached_profile
+            self.is_last_profile_optimal = True
+            # the state of the profile as computed, but the tables
+            self.tables = None
+            self._cached_profile_args = (cost_function, cached_uncertainties)
+            self.uncertainties = [0,] + list(cached_uncertainties[:self.num_profiled_velocities - 1])
+            self.vel_start = vel_start
+            self.vel_space = np.linspace(self.velocity_min, self.velocity_max, self.N)
+            self.vel_ids = range(len(self.vel_space))
+            self.path_ids = range(len(self.uncertainties))
+            self._path_history = None
+            self._trajectory_history = None
+            self._min_vel_ids = None
+            return list(velocity_profile)
+        velocity_profile = self._get_uncached_velocity_profile(vel_start, old_path, uncertainties, cost_function)
+        # the coarse profiles of a time budget are not kept
+        if self.is_last_profile_optimal:
+            self.profile_cache.put(profile_key, (tuple(velocity_profile), list(self.cost_array),
+                                                 list(self.additive_cost_array), self.num_profiled_velocities,
+                                                 tuple(uncertainties)))
+        return velocity_profile
+
+    def _get_uncached_velocity_profile(self, vel_start, old_path, uncertainties, cost_function):
+        self.is_last_profile_optimal = True
+        if self.time_budget is None:
+            return self._get_velocity_profile(vel_start, old_path, uncertainties, cost_function, self.N)
+        deadline = time.time() + self.time_budget
+        velocity_profile = None
+        last_N = None
+        for N in self.get_resolutions():
+            if velocity_profile is not None:
+                # N ** 2 edges per path node
+                expected_duration = last_duration * (float(N) / last_N) ** 2
+                if time.time() + expected_duration > deadline:
+                    break
+            started = time.time()
+            velocity_profile = self._get_velocity_profile(vel_start, old_path, uncertainties, cost_function, N)
+            last_duration = time.time() - started
+            last_N = N
+        self.is_last_profile_optimal = last_N == self.N
+        return velocity_profile
+
+    def get_num_profiled_velocities(self, path_length):
+        """ Number of optimized velocities of the profile of a path of path_length nodes, the start
+        velocity included
+        """
+        if path_length == 0:
+            return 0
+        if self.horizon is None:
+            return path_length + 1
+        return min(path_length, self.horizon) + 1
+
+    def get_terminal_costs(self, tables, uncertainties):
+        """ Costs to go approximating the rest of the path after the horizon, with the uncertainties of
+        its nodes. At most horizon more nodes are looked at, all with their mean uncertainty
+        """
+        uncertainties = uncertainties[:self.horizon]
+        return tables.get_stationary_costs_to_go(float(np.mean(uncertainties)), len(uncertainties))
+
+    def get_resolutions(self):
+        """ Numbers of velocities tried with a time budget, from the coarsest to N """
+        return sorted(set([min(max(2, self.N // 4), self.N), min(max(2, self.N // 2), self.N), self.N]))
+
+    def _get_velocity_profile(self, vel_start, old_path, uncertainties, cost_function, N):
 
         if len(old_path) == 0:
+            self.num_profiled_velocities = 0
             return []
 
-        path = list(old_path)
-        path.insert(0, (-1, {'dist': 0}))
-        self.uncertainties = [0,] + list(uncertainties)
-        self.vel_graph = self.generate_velocity_graph(path,
-                                                      cost_function=cost_function)
-        if len(path) == 1:
-            print("DEBIUUUUG")
-        min_path, min_path_cost, self.path_history = self.get_min_path(vel_start)
-
-        min_trajectory = self.get_trajectory_from_path(min_path)
-
-        self.trajectory_history = []
-        for cost, p in self.path_history:
-            self.trajectory_history.append((cost, self.get_trajectory_from_path(p)))
-
-        return min_trajectory
+        self.num_profiled_velocities = self.get_num_profiled_velocities(len(old_path))
+        num_profiled_nodes = self.num_profiled_velocities - 1
+        self.uncertainties = [0,] + list(uncertainties[:num_profiled_nodes])
+        self.tables = self._update_tables(cost_function, N, uncertainties, num_profiled_nodes)
+        self.vel_start = vel_start
+        self.vel_space = self.tables.vel_space
+        self.vel_ids = range(len(self.vel_space))
+        self.path_ids = range(len(self.uncertainties))
+        self._path_history = None
+        self._trajectory_history = None
+        self._min_vel_ids = None
+
+        id_start = int(np.abs(self.vel_space - vel_start).argmin())
+        min_path = self.tables.get_min_path(id_start)
+        _, self.cost_array, self.additive_cost_array = self.get_path_cost(min_path)
+
+        trajectory = self.get_trajectory_from_path(min_path)
+        return trajectory + [trajectory[-1]] * (len(old_path) - num_profiled_nodes)
+
+    def _update_tables(self, cost_function, N, uncertainties, num_profiled_nodes):
+        """ Returns the tables of N velocities updated with the first num_profiled_nodes uncertainties
+        of a path, the rest of them giving the terminal costs
+        """
+        tables = self.get_tables(cost_function, N)
+        terminal_costs = None
+        if num_profiled_nodes < len(uncertainties):
+            terminal_costs = self.get_terminal_costs(tables, list(uncertainties[num_profiled_nodes:]))
+        tables.update([0,] + list(uncertainties[:num_profiled_nodes]), terminal_costs)
+        return tables
 
     def get_trajectory_from_path(self, path):
         return [self.vel_space[vel_id] for (pose_id, vel_id) in path]
@@ -152,6 +512,7 @@ class VelocityProfiler(object):
         return self.uncertainties
 
     @staticmethod
+    @vectorized_cost_function
     def cost_function(delta_v_norm=0, delta_unc=0, unc=0, next_vel_norm=0, error_norm=0):
 
         a1 = 0
@@ -164,3 +525,27 @@ class VelocityProfiler(object):
         sum_of_terms = a1 * delta_v_norm ** 2 + a2 * delta_unc + a3 * (next_vel_norm*unc) + \
                        a4 * next_vel_norm ** 2 + a5 * error_norm ** 2 + a6 * (error_norm * (1-unc))**2
         return sum_of_terms
+
+
+def get_receding_horizon_profile(velocity_profiler, vel_start, path, uncertainties, cost_function=None):
+    """ Drives along path, of these uncertainties, like a Duckie: the profile is computed again from
+    the node where its optimized velocities run out
+    :return: (velocities, number of profiles) the velocities used at every path node
+    """
+    velocities = None
+    num_profiles = 0
+    velocity_profile = []
+    num_profiled_velocities = 0
+    for path_id in range(len(path)):
+        if num_profiled_velocities <= 1:
+            velocity = vel_start if velocities is None else velocities[-1]
+            velocity_profile = velocity_profiler.get_velocity_profile(velocity, path[path_id:],
+                                                                      uncertainties[path_id:], cost_function)
+            num_profiles += 1
+            num_profiled_velocities = velocity_profiler.num_profiled_velocities
+            if velocities is None:
+                velocities = [velocity_profile[0]]
+        velocity_profile.pop(0)
+        num_profiled_velocities -= 1
+        velocities.append(velocity_profile[0])
+    return velocities, num_profiles
@@ -2,4 +2,8 @@
 from .duckie_town import *
 from .duckie import *
 from .utils import *
-from .constant import *
\ No newline at end of file
+from .constant import *
+from .collision import *
+from .spatial_index import *
+from .broad_phase import *
+from .map_cache import *
\ No newline at end of file
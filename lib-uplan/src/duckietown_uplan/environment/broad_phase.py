@@ -0,0 +1,65 @@
+"""
+This class is supposed to quickly find the duckies that are close to each other
+"""
+__all__ = [
+    'UniformGrid',
+]
+
+import collections
+import numpy as np
+
+
+class UniformGrid(object):
+    """ Uniform grid hashing the duckie centres, it is updated incrementally when a duckie moves
+    and a query only visits the cells overlapped by the query circle
+    cell_size: side of a square cell, the typical query radius is a good choice
+    """
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = collections.defaultdict(set)
+        self.items = {}
+
+    def _get_cell(self, position):
+        return int(np.floor(position[0] / self.cell_size)), int(np.floor(position[1] / self.cell_size))
+
+    def insert(self, item_id, position):
+        position = np.array(position, dtype='float64')
+        cell = self._get_cell(position)
+        self.cells[cell].add(item_id)
+        self.items[item_id] = (cell, position)
+
+    def update(self, item_id, position):
+        old_cell, _ = self.items[item_id]
+        position = np.array(position, dtype='float64')
+        cell = self._get_cell(position)
+        if cell != old_cell:
+            self.cells[old_cell].discard(item_id)
+            if len(self.cells[old_cell]) == 0:
+                del self.cells[old_cell]
+            self.cells[cell].add(item_id)
+        self.items[item_id] = (cell, position)
+
+    def remove(self, item_id):
+        cell, _ = self.items.pop(item_id)
+        self.cells[cell].discard(item_id)
+        if len(self.cells[cell]) == 0:
+            del self.cells[cell]
+
+    def clear(self):
+        self.cells = collections.defaultdict(set)
+        self.items = {}
+
+    def query(self, position, radius):
+        """ Returns the sorted ids of the items whose centre is within radius of position """
+        min_x, min_y = self._get_cell(np.asarray(position) - radius)
+        max_x, max_y = self._get_cell(np.asarray(position) + radius)
+        candidates = []
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = (cell_x, cell_y)
+                if cell not in self.cells:
+                    continue
+                for item_id in self.cells[cell]:
+                    if np.linalg.norm(self.items[item_id][1] - position) <= radius:
+                        candidates.append(item_id)
+        return sorted(candidates)
@@ -0,0 +1,136 @@
+"""
+Batched collision tests between oriented boxes placed on the graph nodes
+"""
+__all__ = [
+    'get_overlapping_pairs',
+    'build_collision_matrix',
+    'get_colliding_indices',
+    'to_local_frame',
+    'to_world_frame',
+    'are_points_in_convex_polygon',
+    'are_convex_polygons_intersecting',
+]
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+
+def _are_boxes_separated(delta, axes_a, axes_b, half_extents):
+    """ Separating axis test for pairs of equally sized oriented boxes
+    delta: (M, 2) vector between the box centres
+    axes_a, axes_b: (M, 2, 2) unit axes (heading, lateral) of each box
+    half_extents: (2,) half width and half height shared by the boxes
+    """
+    separated = np.zeros(len(delta), dtype=bool)
+    for axes in (axes_a, axes_b):
+        for k in range(2):
+            axis = axes[:, k, :]
+            distance = np.abs(np.sum(delta * axis, axis=1))
+            radius_a = np.abs(np.sum(axes_a * axis[:, np.newaxis, :], axis=2)).dot(half_extents)
+            radius_b = np.abs(np.sum(axes_b * axis[:, np.newaxis, :], axis=2)).dot(half_extents)
+            separated |= distance > radius_a + radius_b
+    return separated
+
+
+def get_overlapping_pairs(positions, thetas, width, height, block_size=4096):
+    """ Finds all the pairs (i, j), i < j, of overlapping boxes. The candidates are the pairs of
+    boxes whose bounding circles overlap, found with a KD-tree, and only they go through the
+    separating axis test, by blocks of block_size pairs
+    :return: two int arrays with the i and j indices of the overlapping pairs, sorted
+    """
+    positions = np.asarray(positions, dtype='float64')
+    thetas = np.asarray(thetas, dtype='float64')
+    num_boxes = len(thetas)
+    half_extents = np.array([width / 2., height / 2.])
+    max_center_dist = 2 * np.linalg.norm(half_extents)
+    if num_boxes < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    axes = np.empty((num_boxes, 2, 2))
+    axes[:, 0, 0] = np.cos(thetas)
+    axes[:, 0, 1] = np.sin(thetas)
+    axes[:, 1, 0] = -axes[:, 0, 1]
+    axes[:, 1, 1] = axes[:, 0, 0]
+
+    # (M, 2) pairs with i < j, collision is symmetric
+    candidates = cKDTree(positions).query_pairs(max_center_dist, output_type='ndarray').astype(int)
+    candidates = candidates[np.lexsort((candidates[:, 1], candidates[:, 0]))]
+    rows = [np.zeros(0, dtype=int)]
+    cols = [np.zeros(0, dtype=int)]
+    for start in range(0, len(candidates), block_size):
+        block_i = candidates[start:start + block_size, 0]
+        block_j = candidates[start:start + block_size, 1]
+        separated = _are_boxes_separated(positions[block_j] - positions[block_i],
+                                         axes[block_i], axes[block_j], half_extents)
+        rows.append(block_i[~separated])
+        cols.append(block_j[~separated])
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def build_collision_matrix(positions, thetas, width, height, block_size=4096):
+    """ Returns the symmetric 0/1 matrix of overlapping boxes as a CSR sparse matrix,
+    every box collides with itself. Time and memory grow with the number of colliding pairs
+    """
+    num_boxes = len(thetas)
+    rows, cols = get_overlapping_pairs(positions, thetas, width, height, block_size=block_size)
+    diagonal = np.arange(num_boxes)
+    all_rows = np.concatenate([diagonal, rows, cols])
+    all_cols = np.concatenate([diagonal, cols, rows])
+    data = np.ones(len(all_rows), dtype=np.uint8)
+    return csr_matrix((data, (all_rows, all_cols)), shape=(num_boxes, num_boxes))
+
+
+def get_colliding_indices(collision_matrix, indices):
+    """ Returns the sorted indices of the nodes colliding with any of the given nodes,
+    only the rows of the given nodes are visited
+    """
+    if len(indices) == 0:
+        return np.zeros(0, dtype=int)
+    indices = np.unique(indices)
+    starts = collision_matrix.indptr[indices]
+    ends = collision_matrix.indptr[indices + 1]
+    colliding = [collision_matrix.indices[start:end] for start, end in zip(starts, ends)]
+    return np.unique(np.concatenate(colliding))
+
+
+def to_local_frame(points, position, theta):
+    """ Expresses world points (N, 2) in the frame of the pose (position, theta)
+    with a single matrix product
+    """
+    rotation = np.array([[np.cos(theta), -np.sin(theta)],
+                         [np.sin(theta), np.cos(theta)]])
+    return (np.asarray(points) - position).dot(rotation)
+
+
+def to_world_frame(points, position, theta):
+    """ Inverse of to_local_frame, moves points (N, 2) expressed in the pose frame to the world """
+    rotation = np.array([[np.cos(theta), -np.sin(theta)],
+                         [np.sin(theta), np.cos(theta)]])
+    return np.asarray(points).dot(rotation.T) + position
+
+
+def are_points_in_convex_polygon(points, polygon):
+    """ Returns a boolean mask of the points (N, 2) strictly inside the convex polygon (M, 2),
+    whatever the orientation of its corners, boundary points are outside like with shapely contains
+    """
+    polygon = np.asarray(polygon)
+    edges = np.roll(polygon, -1, axis=0) - polygon
+    relative_x = points[:, np.newaxis, 0] - polygon[np.newaxis, :, 0]
+    relative_y = points[:, np.newaxis, 1] - polygon[np.newaxis, :, 1]
+    cross = edges[np.newaxis, :, 0] * relative_y - edges[np.newaxis, :, 1] * relative_x
+    return np.all(cross > 0, axis=1) | np.all(cross < 0, axis=1)
+
+
+def are_convex_polygons_intersecting(polygon_1, polygon_2):
+    """ Separating axis test between two convex polygons given as (M, 2) corner arrays,
+    touching polygons intersect like with shapely intersects
+    """
+    for polygon in (polygon_1, polygon_2):
+        edges = np.roll(polygon, -1, axis=0) - polygon
+        normals = np.stack([-edges[:, 1], edges[:, 0]], axis=1)
+        projections_1 = np.dot(polygon_1, normals.T)
+        projections_2 = np.dot(polygon_2, normals.T)
+        if np.any((projections_1.max(axis=0) < projections_2.min(axis=0)) |
+                  (projections_2.max(axis=0) < projections_1.min(axis=0))):
+            return False
+    return True
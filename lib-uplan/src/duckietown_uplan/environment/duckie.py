@@ -8,8 +8,10 @@ import geometry as geo
 from duckietown_world.geo.transforms import SE2Transform
 from duckietown_uplan.environment.utils import move_point, euclidean_distance, \
     is_point_in_bounding_box, interpolate, get_closest_neighbor
+from duckietown_uplan.environment.collision import to_world_frame
 from duckietown_uplan.environment.constant import Constants as CONSTANTS
 from duckietown_uplan.algo.path_planning import PathPlanner
+from duckietown_uplan.algo.planning_pool import PlanningPool
 from duckietown_uplan.algo.velocity_profiling import VelocityProfiler
 from duckietown_uplan.algo.observations import ObservationModel
 import numpy as np
@@ -21,10 +23,19 @@ class Duckie(object):
         self.id = id
         self.size_x = size_x
         self.size_y = size_y
+        # the corner arrays are cached until the pose changes, every assignment of current_position
+        # bumps pose_version
+        self.pose_version = 0
+        self.geometry_cache = {}
+        # called with this duckie whenever pose_version changes, e.g. to keep a spatial index in sync
+        self.pose_listener = None
         self.current_position = position
         self.velocity = velocity #cm/s
         self.current_path = [] #stack
         self.current_velocity_profile = []  # stack
+        # velocities of current_velocity_profile optimized by the profiler, the rest repeats the last
+        # one until the profile is extended, see VelocityProfiler.horizon
+        self.num_profiled_velocities = 0
         self.motor_off = False
         self.destination_node = None
         self.current_observed_nodes = None
@@ -38,9 +49,18 @@ class Duckie(object):
         self.my_closest_control_point = None
         self.observation_model = None
         self.replan = False
+        # a cooperative duckie keeps its path at a control point but profiles it again
+        self.reprofile = False
+        self.num_replans = 0
+        # shared ReservationTable of the cooperative planning, None when the duckies only react
+        self.reservation_table = None
         self.occupancy_vector = collections.deque(maxlen=10)
 
-    def map_environment(self, graph, node_to_index, index_to_node, collision_matrix):
+    def map_environment(self, graph, node_to_index, index_to_node, collision_matrix, node_index=None,
+                        planner_mode='dijkstra', landmark_table=None, route_cache=None, compact_graph=None,
+                        contraction_hierarchy=None, reservation_table=None, path_time_budget=None,
+                        profile_time_budget=None, profile_horizon=None, max_velocity_change=None,
+                        profile_cache=None):
         #args need to be refactored
         self.env_graph = graph
         self.path_planner = PathPlanner(self.env_graph,
@@ -48,11 +68,22 @@ class Duckie(object):
                                         width=self.size_x,
                                         node_to_index=node_to_index,
                                         index_to_node=index_to_node,
-                                        collision_matrix=collision_matrix
+                                        collision_matrix=collision_matrix,
+                                        mode=planner_mode,
+                                        landmark_table=landmark_table,
+                                        contraction_hierarchy=contraction_hierarchy,
+                                        route_cache=route_cache,
+                                        compact_graph=compact_graph,
+                                        time_budget=path_time_budget
                                         )
-        self.velocity_profiler = VelocityProfiler(velocity_min=0.1, velocity_max=0.7, N=10)
-        self.my_closest_control_point, _ = get_closest_neighbor(graph, self.current_position)
+        self.velocity_profiler = VelocityProfiler(velocity_min=0.1, velocity_max=0.7, N=10,
+                                                  time_budget=profile_time_budget, horizon=profile_horizon,
+                                                  max_velocity_change=max_velocity_change,
+                                                  profile_cache=profile_cache)
+        self.my_closest_control_point, _ = get_closest_neighbor(graph, self.current_position,
+                                                                node_index=node_index)
         self.observation_model = ObservationModel(graph)
+        self.reservation_table = reservation_table
         return
 
     def move(self, time_in_seconds):
@@ -60,31 +91,64 @@ class Duckie(object):
         TODO: take in consideration smooth turns and case where the duckie is not exactly on a trajectory
         TODO: currently assuming that duckies are always on a path
         """
-        print("Started move function")
-        self.observation_model.update_obstacles_uncertainity(self.get_current_observations())
-
-        path_nodes = [path_node[1]['point'] for path_node in self.current_path]
-        if len(self.current_path) > 0 and (self.current_position == path_nodes[0].as_SE2()).all():
-            my_closest_control_point = self.current_path.pop(0)
-            self.current_velocity_profile.pop(0)
-            self.my_closest_control_point = my_closest_control_point[0]
-
-        if len(self.current_path) == 0:
+        if not self.start_move():
             return
         #replan only when above a control point
         if self.replan:
             self.replan = False
             print('replanning now')
-            self.current_path = self.path_planner.get_shortest_path(self.my_closest_control_point,
-                                                                    self.destination_node,
-                                                                    self.get_fov_occupancy())
-            self.current_velocity_profile = self.velocity_profiler.get_velocity_profile(self.velocity,
-                                                                                        self.current_path,
-                                                                                        self.observation_model.get_path_uncertainities(self.current_path))
-            path_nodes = [path_node[1]['point'] for path_node in self.current_path]
+            self.num_replans += 1
+            self.current_path = self._plan_path(self.get_fov_occupancy())
+            self._profile_path()
+            self._reserve_path([self._get_constant_velocity_profile()])
             if len(self.current_path) == 0:
                 return
+        self.finish_move(time_in_seconds)
 
+    def start_move(self):
+        """ First part of move, updates the observations and pops the reached control point,
+        returns False if there is no path left to follow
+        """
+        print("Started move function")
+        self.observation_model.update_obstacles_uncertainity(self.get_current_observations())
+
+        if len(self.current_path) > 0 and \
+                (self.current_position == self.current_path[0][1]['point'].as_SE2()).all():
+            my_closest_control_point = self.current_path.pop(0)
+            self.current_velocity_profile.pop(0)
+            self.num_profiled_velocities -= 1
+            self.my_closest_control_point = my_closest_control_point[0]
+        # the profile of a horizon is extended once its optimized velocities are used, unless the
+        # whole path is planned again anyway
+        if len(self.current_path) > 0 and (self.num_profiled_velocities <= 1 or self.reprofile) and \
+                not self.replan:
+            previous_velocity_profile = self.current_velocity_profile
+            self._profile_path()
+            self._reserve_path([previous_velocity_profile])
+        self.reprofile = False
+        return len(self.current_path) > 0
+
+    def get_replan_request(self):
+        """ Takes the pending replan of a move out of the duckie, to be planned by a PlanningPool,
+        see set_planned_path for its result
+        """
+        self.replan = False
+        print('replanning now')
+        self.num_replans += 1
+        return PlanningPool.get_request(self.my_closest_control_point, self.destination_node,
+                                        self.get_fov_occupancy(), self.velocity, self.velocity_profiler,
+                                        self.observation_model)
+
+    def set_planned_path(self, path_node_names, velocity_profile):
+        self.current_path = [(path_node_name, self.env_graph.nodes[path_node_name])
+                             for path_node_name in path_node_names]
+        self.current_velocity_profile = list(velocity_profile)
+        self.num_profiled_velocities = self.velocity_profiler.get_num_profiled_velocities(len(self.current_path))
+        self._reserve_path()
+
+    def finish_move(self, time_in_seconds):
+        """ Second part of move, drives along the current path for time_in_seconds """
+        path_nodes = [path_node[1]['point'] for path_node in self.current_path]
         if self.motor_off:
             return
         num_alpha = 20
@@ -126,28 +190,47 @@ class Duckie(object):
                 path_nodes.pop(0)
                 my_closest_control_point = self.current_path.pop(0)
                 self.current_velocity_profile.pop(0)
+                self.num_profiled_velocities -= 1
                 if len(self.current_velocity_profile) > 0:
                     delta_t = time_in_seconds - (dist / self.velocity)
                     distance_to_travel = delta_t * self.current_velocity_profile[0]
                     dist = 0
                     self.velocity = self.current_velocity_profile[0]
                 self.my_closest_control_point = my_closest_control_point[0]
-                self.replan = True
+                # a cooperative path stays valid while its reservations hold
+                if self.reservation_table is None:
+                    self.replan = True
+                else:
+                    self.reprofile = True
             old_pose = pose
 
         p, theta = geo.translation_angle_from_SE2(old_pose)
 
-        self.current_position = SE2Transform(p, theta)
+        self._set_pose(SE2Transform(p, theta))
         return
 
+    @property
+    def current_position(self):
+        return self._current_position
+
+    @current_position.setter
+    def current_position(self, position):
+        self._set_pose(position)
+
     def get_current_positon(self):
         return self.current_position
 
     def set_current_positon(self, position):
-        self.current_position = position
+        self._set_pose(position)
         # self.my_closest_control_point, _ = get_closest_neighbor(self.env_graph, self.current_position)
         return
 
+    def _set_pose(self, position):
+        self._current_position = position
+        self.pose_version += 1
+        if self.pose_listener is not None:
+            self.pose_listener(self)
+
     def get_closest_node(self):
         return self.my_closest_control_point
 
@@ -162,8 +245,9 @@ class Duckie(object):
         return [node_path[1]['point'] for node_path in self.current_path]
 
     def get_max_radius(self):
-        dif = self.current_position.p - self.get_field_of_view()[-1].p
-        offset = self.current_position.p - self.get_duckie_bounding_box()[1].p  #lower left corner
+        # does not depend on the pose, the distances are measured in the duckie frame
+        dif = self.get_local_field_of_view()[-1]
+        offset = self.get_local_bounding_box()[1]  #lower left corner
         return np.linalg.norm(dif) + np.linalg.norm(offset)
 
     def append_path(self, path):
@@ -196,14 +280,84 @@ class Duckie(object):
                     occupied_nodes.append(duckie_foot_print_node[1]['point'])
         return occupied_nodes
 
-    def set_target_destination(self, destination_node):
+    def set_target_destination(self, destination_node, path=None):
+        """ path: already planned path to destination_node (e.g. by DuckieTown.plan_paths) """
         self.destination_node = destination_node
-        self.current_path = self.path_planner.get_shortest_path(self.my_closest_control_point,
-                                                                self.destination_node)
+        if path is None:
+            path = self._plan_path([])
+        self.current_path = path
+        self._profile_path()
+        self._reserve_path([self._get_constant_velocity_profile()])
+        return
+
+    def _profile_path(self):
+        """ Profiles the velocities of the current path from the current velocity """
         self.current_velocity_profile = self.velocity_profiler.get_velocity_profile(self.velocity,
                                                                                     self.current_path,
                                                                                     self.observation_model.get_path_uncertainities(self.current_path))
-        return
+        self.num_profiled_velocities = self.velocity_profiler.num_profiled_velocities
+
+    def _plan_path(self, occupancy_node_names):
+        if self.reservation_table is None:
+            return self.path_planner.get_shortest_path(self.my_closest_control_point,
+                                                       self.destination_node,
+                                                       occupancy_node_names)
+        # the old reservations of this duckie must not block its new path
+        self.reservation_table.release(self.id)
+        return self.path_planner.get_cooperative_path(self.my_closest_control_point,
+                                                      self.destination_node,
+                                                      occupancy_node_names,
+                                                      self.reservation_table,
+                                                      self.id,
+                                                      speed=self.velocity,
+                                                      start_position=self.current_position.p)
+
+    def get_path_arrival_times(self, start_time=0., velocity_profile=None):
+        """ Times at which the nodes of the current path are reached with velocity_profile, the
+        current velocity profile by default. Like in finish_move the k-th node is driven to at
+        velocity_profile[k], the last velocity (the one at the end of the path) is not used
+        """
+        if velocity_profile is None:
+            velocity_profile = self.current_velocity_profile
+        arrival_times = []
+        time = start_time
+        position = self.current_position.p
+        for (_, path_node), velocity in zip(self.current_path, velocity_profile):
+            node_position = path_node['point'].p
+            time += np.linalg.norm(node_position - position) / velocity
+            arrival_times.append(time)
+            position = node_position
+        return arrival_times
+
+    def _get_constant_velocity_profile(self):
+        # the velocities the cooperative search assumes, see _plan_path, shaped like the profiles
+        # of the velocity profiler: one per node of the path plus the start one
+        return [self.velocity] * (len(self.current_path) + 1)
+
+    def _reserve_path(self, fallback_velocity_profiles=()):
+        """ Reserves the current path for the windows of the current velocity profile. If another
+        duckie holds one of them the first of fallback_velocity_profiles whose windows are free is
+        driven instead, and if there is none the path is planned again at the next move
+        """
+        if self.reservation_table is None:
+            return
+        self.reservation_table.release(self.id)
+        node_names = [self.my_closest_control_point] + [path_node_name for path_node_name, _ in self.current_path]
+        node_ids = self.path_planner.compact_graph.get_ids(node_names)
+        current_time = self.reservation_table.current_time
+        for velocity_profile in [self.current_velocity_profile] + list(fallback_velocity_profiles):
+            arrival_times = [current_time] + self.get_path_arrival_times(current_time, velocity_profile)
+            if not self.reservation_table.is_path_reserved(node_ids, arrival_times, self.id):
+                break
+        else:
+            self.replan = True
+            velocity_profile = self.current_velocity_profile
+            arrival_times = [current_time] + self.get_path_arrival_times(current_time)
+        if velocity_profile is not self.current_velocity_profile:
+            self.current_velocity_profile = list(velocity_profile)
+            # not extended, it is profiled again at the next control point anyway
+            self.num_profiled_velocities = len(velocity_profile)
+        self.reservation_table.reserve(self.id, node_ids, arrival_times)
 
     def stop_movement(self):
         self.motor_off = True
@@ -223,9 +377,13 @@ class Duckie(object):
 
     def set_current_frame(self, observed_duckies, observed_nodes):
         self.current_observed_duckies = observed_duckies
-        if len(self.current_observed_duckies):
-            self.replan = True
         self.current_observed_nodes = observed_nodes
+        # the cooperative paths already avoid the others, only a duckie in the way needs a replan
+        if len(self.current_observed_duckies) and \
+                (self.reservation_table is None or
+                 (len(self.current_path) > 0 and
+                  self.path_planner.is_path_blocked(self.current_path, self.get_current_fov_occupancy()))):
+            self.replan = True
         return
 
     def set_foot_print(self, foot_print):
@@ -236,74 +394,65 @@ class Duckie(object):
         self.current_safe_foot_print = safe_foot_print
         return
 
+    def get_local_field_of_view(self):
+        # BB ll, lr, ul, ur in the duckie frame
+        return np.array([[self.size_x/2, self.size_y/2],
+                         [self.size_x/2, -self.size_y/2],
+                         [CONSTANTS.FOV_vertical + self.size_x/2, -CONSTANTS.FOV_horizontal],
+                         [CONSTANTS.FOV_vertical + self.size_x/2, CONSTANTS.FOV_horizontal]])
+
+    def get_local_bounding_box(self):
+        # BB ll, lr, ul, ur in the duckie frame
+        return np.array([[-self.size_x/2, -self.size_y/2],
+                         [self.size_x/2, -self.size_y/2],
+                         [self.size_x/2, self.size_y/2],
+                         [-self.size_x/2, self.size_y/2]])
+
+    def get_local_safe_bounding_box(self):
+        # BB ll, lr, ul, ur in the duckie frame
+        safe_dist = 0.02
+        return np.array([[-self.size_x/2 - safe_dist, -self.size_y/2 - safe_dist],
+                         [self.size_x/2 + safe_dist, -self.size_y/2 - safe_dist],
+                         [self.size_x/2 + safe_dist, self.size_y/2 + safe_dist],
+                         [-self.size_x/2 - safe_dist, self.size_y/2 + safe_dist]])
+
+    def _get_cached_geometry(self, name, build):
+        cached = self.geometry_cache.get(name)
+        if cached is None or cached[0] != self.pose_version:
+            cached = (self.pose_version, build())
+            self.geometry_cache[name] = cached
+        return cached[1]
+
+    def _get_world_corners(self, get_local_corners):
+        corners = to_world_frame(get_local_corners(), self.current_position.p, self.current_position.theta)
+        corners.flags.writeable = False
+        return corners
+
+    def _get_corners_SE2(self, corners):
+        return [SE2Transform(corner, self.current_position.theta) for corner in corners]
+
+    def get_field_of_view_corners(self):
+        return self._get_cached_geometry('fov', lambda: self._get_world_corners(self.get_local_field_of_view))
+
+    def get_duckie_bounding_box_corners(self):
+        return self._get_cached_geometry('bb', lambda: self._get_world_corners(self.get_local_bounding_box))
+
+    def get_duckie_safe_bounding_box_corners(self):
+        return self._get_cached_geometry('safe_bb',
+                                         lambda: self._get_world_corners(self.get_local_safe_bounding_box))
+
     def get_field_of_view(self):
-        # BB ll, lr, ul, ur
-        bounding_box = []
-        # lower_right
-        relative_transform = geo.SE2_from_translation_angle([self.size_x/2, self.size_y/2], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # lower_left
-        relative_transform = geo.SE2_from_translation_angle([self.size_x/2, -self.size_y/2], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # upper left
-        relative_transform = geo.SE2_from_translation_angle([CONSTANTS.FOV_vertical + self.size_x/2,
-                                                             -CONSTANTS.FOV_horizontal], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # upper right
-        relative_transform = geo.SE2_from_translation_angle([CONSTANTS.FOV_vertical + self.size_x/2,
-                                                             CONSTANTS.FOV_horizontal], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-
-        return bounding_box
+        return list(self._get_cached_geometry('fov_SE2',
+                                              lambda: self._get_corners_SE2(self.get_field_of_view_corners())))
 
     def get_duckie_bounding_box(self):
-        # BB ll, lr, ul, ur
-        bounding_box = []
-        # lower_right
-        relative_transform = geo.SE2_from_translation_angle([-self.size_x/2, -self.size_y/2], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # lower_left
-        relative_transform = geo.SE2_from_translation_angle([self.size_x/2, -self.size_y/2], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # upper left
-        relative_transform = geo.SE2_from_translation_angle([self.size_x/2, self.size_y/2], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # upper right
-        relative_transform = geo.SE2_from_translation_angle([-self.size_x/2, self.size_y/2], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-
-        return bounding_box
+        return list(self._get_cached_geometry('bb_SE2',
+                                              lambda: self._get_corners_SE2(self.get_duckie_bounding_box_corners())))
 
     def get_duckie_safe_bounding_box(self):
-        # BB ll, lr, ul, ur
-        bounding_box = []
-        # lower_right
-        safe_dist = 0.02
-        relative_transform = geo.SE2_from_translation_angle([-self.size_x/2 - safe_dist, -self.size_y/2 - safe_dist], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # lower_left
-        relative_transform = geo.SE2_from_translation_angle([self.size_x/2 + safe_dist, -self.size_y/2 - safe_dist], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # upper left
-        relative_transform = geo.SE2_from_translation_angle([self.size_x/2 + safe_dist, self.size_y/2 + safe_dist], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-        # upper right
-        relative_transform = geo.SE2_from_translation_angle([-self.size_x/2 - safe_dist, self.size_y/2 + safe_dist], 0)
-        transform = geo.SE2.multiply(self.current_position.as_SE2(), relative_transform)
-        bounding_box.append(SE2Transform.from_SE2(transform))
-
-        return bounding_box
+        return list(self._get_cached_geometry('safe_bb_SE2',
+                                              lambda: self._get_corners_SE2(
+                                                  self.get_duckie_safe_bounding_box_corners())))
 
     def get_current_observations(self):
         fov_occupancy_nodes = self.get_current_fov_occupancy()
@@ -15,34 +15,66 @@ from duckietown_uplan.environment.utils import draw_graphs, create_graph_from_po
     create_graph_from_nodes
 from random import randint
 from duckietown_uplan.environment.footprint_table import FootprintTable
+from duckietown_uplan.environment.collision import build_collision_matrix, to_local_frame, \
+    are_points_in_convex_polygon, are_convex_polygons_intersecting
+from duckietown_uplan.environment.spatial_index import NodeIndex
+from duckietown_uplan.environment.broad_phase import UniformGrid
+from duckietown_uplan.algo.path_planning import PathPlanner
+from duckietown_uplan.algo.graph_search import LandmarkTable
+from duckietown_uplan.algo.caching import LRUCache
+from duckietown_uplan.algo.reservation_table import ReservationTable
+from duckietown_uplan.algo.planning_pool import PlanningPool
+from duckietown_uplan.algo.contraction_hierarchy import ContractionHierarchy
+from duckietown_uplan.graph_utils.compact_graph import CompactGraph
+from scipy.sparse import csr_matrix
 from duckietown_world.geo.transforms import SE2Transform
 import numpy as np
 import time
 
 
 class DuckieTown(object):
-    def __init__(self, map):
+    """ map_cache: optional MapCache, the graphs, the collision matrix and the footprint table
+    are then loaded from it when this map was already preprocessed with the same parameters
+    """
+    def __init__(self, map, map_cache=None):
         self.original_map = map
         self.tile_size = map.tile_size
-        self.skeleton_graph = dw.get_skeleton_graph(map)
-        self.current_graph = self.skeleton_graph.G
+        self.map_cache = map_cache
+        self.map_digest = None
+        self.planner_mode = 'dijkstra'
+        self.num_landmarks = 8
+        self.landmark_table = None
+        self.contraction_hierarchy = None
+        self.route_cache_size = 1024
+        self.profile_cache_size = 1024
+        # velocity profiles shared by the profilers of the duckies, they do not depend on the graph
+        self.profile_cache = LRUCache(max_size=self.profile_cache_size)
+        # ReservationTable of the cooperative planning, see set_cooperative_planning
+        self.reservation_table = None
+        # PlanningPool of the parallel planning, see set_parallel_planning
+        self.planning_pool = None
+        # seconds a search and a velocity profile may take, see set_planning_time_budget
+        self.path_time_budget = None
+        self.profile_time_budget = None
+        # path nodes profiled ahead by the duckies, see set_profile_horizon
+        self.profile_horizon = None
+        # largest velocity change of the duckies between two path nodes, see set_max_velocity_change
+        self.max_velocity_change = None
         self.duckie_citizens = []
         self.current_occupied_nodes = []
-        self.node_to_index = {}
-        self.index_to_node = {}
-        for i, name in enumerate(self.current_graph):
-            self.node_to_index[name] = i
-            self.index_to_node[i] = name
-        self.collision_matrix = self._build_collision_matrix()
-        #build the clustered graph with a random duckie
-        random_node, _ = self.get_random_node_in_graph()
-        max_radius = Duckie(-1,
-                              CONSTANTS.duckie_width,
-                              CONSTANTS.duckie_height,
-                              velocity=0.25,
-                              position=random_node['point']).get_max_radius()
-        foot_print_table = FootprintTable(self.current_graph, max_radius)
-        self.clustered_graph = foot_print_table.get_data()
+        cached = self._load_cached_artifacts('skeleton')
+        if cached is None:
+            self.skeleton_graph = dw.get_skeleton_graph(map)
+            self.current_graph = self.skeleton_graph.G
+        else:
+            # the drawing roots are only rebuilt when drawing
+            self.skeleton_graph = segmentify.SkeletonGraphResult(root=None, root2=None, G=cached[0]['graph'])
+            self.current_graph = self.skeleton_graph.G
+        self._preprocess_current_graph(cached)
+        if cached is None:
+            self._save_cached_artifacts('skeleton')
+        # broad phase for the duckie to duckie checks, a query covers the neighboring cells only
+        self.duckie_grid = UniformGrid(cell_size=self.max_duckie_radius)
 
     def get_map_original_graph(self):
         return dw.get_skeleton_graph(self.original_map).G
@@ -50,30 +82,219 @@ class DuckieTown(object):
     def get_current_graph(self):
         return self.current_graph
 
-    def augment_graph(self):
-        self.skeleton_graph = segmentify.get_skeleton_graph(self.original_map)  # to be changed accordig to Jose
-        self.current_graph = GraphAugmenter.augment_graph(self.skeleton_graph.G,
-                                                          num_long=0,
-                                                          num_right=1,
-                                                          num_left=0,
-                                                          lat_dist=0.3)
+    def augment_graph(self, num_long=0, num_right=1, num_left=0, lat_dist=0.3):
+        augmentation_params = dict(num_long=num_long, num_right=num_right, num_left=num_left, lat_dist=lat_dist)
+        cached = self._load_cached_artifacts('augmented', **augmentation_params)
+        if cached is None:
+            self.skeleton_graph = segmentify.get_skeleton_graph(self.original_map)  # to be changed accordig to Jose
+            self.current_graph = GraphAugmenter.augment_graph(self.skeleton_graph.G, **augmentation_params)
+        else:
+            self.skeleton_graph = segmentify.SkeletonGraphResult(root=None, root2=None, G=cached[0]['skeleton_graph'])
+            self.current_graph = cached[0]['graph']
+        self._preprocess_current_graph(cached)
+        if cached is None:
+            self._save_cached_artifacts('augmented', **augmentation_params)
+        return
+
+    def _get_cache_key(self, stage, **params):
+        if self.map_digest is None:
+            self.map_digest = self.map_cache.get_map_digest(self.original_map)
+        return self.map_cache.get_key(self.map_digest, stage, **params)
+
+    def _load_cached_artifacts(self, stage, **params):
+        if self.map_cache is None:
+            return None
+        return self.map_cache.load(self._get_cache_key(stage, **params))
+
+    def _save_cached_artifacts(self, stage, **params):
+        if self.map_cache is None:
+            return
+        objects = {'graph': self.current_graph,
+                   'skeleton_graph': self.skeleton_graph.G,
+                   'node_names': [self.index_to_node[i] for i in range(len(self.index_to_node))]}
+        arrays = {'collision_indptr': self.collision_matrix.indptr,
+                  'collision_indices': self.collision_matrix.indices,
+                  'collision_data': self.collision_matrix.data,
+                  'footprint_indptr': self.foot_print_table.indptr,
+                  'footprint_indices': self.foot_print_table.indices}
+        self.map_cache.save(self._get_cache_key(stage, **params), objects, arrays)
+
+    def _preprocess_current_graph(self, cached=None):
+        """ cached: (objects, arrays) loaded from the map cache for the current graph, if any """
+        # everything derived from the current graph is built once here and shared by the duckies
+        if cached is None:
+            node_names = list(self.current_graph)
+        else:
+            # the cached arrays are indexed in the order the nodes had when they were built
+            node_names = cached[0]['node_names']
         self.node_to_index = {}
         self.index_to_node = {}
-        for i, name in enumerate(self.current_graph):
+        for i, name in enumerate(node_names):
             self.node_to_index[name] = i
             self.index_to_node[i] = name
-        self.collision_matrix = self._build_collision_matrix()
+        # one mapping and one pose array, shared by the node index and the compact graph
+        node_positions = np.array([self.current_graph.nodes[name]['point'].p for name in node_names],
+                                  dtype='float64').reshape(len(node_names), 2)
+        node_thetas = np.array([self.current_graph.nodes[name]['point'].theta for name in node_names],
+                               dtype='float64')
+        self.node_index = NodeIndex(self.current_graph, node_names, node_to_index=self.node_to_index,
+                                    positions=node_positions, thetas=node_thetas)
+        if cached is None:
+            self.collision_matrix = self._build_collision_matrix()
+        else:
+            arrays = cached[1]
+            self.collision_matrix = csr_matrix((arrays['collision_data'],
+                                                arrays['collision_indices'],
+                                                arrays['collision_indptr']),
+                                               shape=(len(node_names), len(node_names)))
         # build the clustered graph with a random duckie
         random_node, _ = self.get_random_node_in_graph()
-        max_radius = Duckie(-1,
-                            CONSTANTS.duckie_width,
-                            CONSTANTS.duckie_height,
-                            velocity=0.25,
-                            position=random_node['point']).get_max_radius()
-        foot_print_table = FootprintTable(self.current_graph, max_radius)
-        self.clustered_graph = foot_print_table.get_data()
+        self.max_duckie_radius = Duckie(-1,
+                                        CONSTANTS.duckie_width,
+                                        CONSTANTS.duckie_height,
+                                        velocity=0.25,
+                                        position=random_node['point']).get_max_radius()
+        if cached is None:
+            self.foot_print_table = FootprintTable(self.current_graph, self.max_duckie_radius,
+                                                   node_index=self.node_index)
+        else:
+            self.foot_print_table = FootprintTable(self.current_graph, self.max_duckie_radius,
+                                                   node_index=self.node_index,
+                                                   indptr=cached[1]['footprint_indptr'],
+                                                   indices=cached[1]['footprint_indices'])
+        # integer ids, CSR adjacency and pose arrays for the planners, ids are the node indices
+        self.compact_graph = CompactGraph(self.current_graph, node_names=node_names,
+                                          node_to_id=self.node_to_index, positions=node_positions,
+                                          headings=node_thetas)
+        self.landmark_table = None
+        if self.planner_mode == 'alt':
+            self.landmark_table = self._build_landmark_table()
+        self.contraction_hierarchy = None
+        if self.planner_mode == 'ch':
+            self.contraction_hierarchy = ContractionHierarchy(self.compact_graph)
+        # routes shared by all the planners of this graph
+        self.route_cache = LRUCache(max_size=self.route_cache_size)
+        # planner of the batch requests, the duckies keep their own for their replans
+        self.path_planner = PathPlanner(self.current_graph,
+                                        length=CONSTANTS.duckie_height,
+                                        width=CONSTANTS.duckie_width,
+                                        node_to_index=self.node_to_index,
+                                        index_to_node=self.index_to_node,
+                                        collision_matrix=self.collision_matrix,
+                                        mode=self.planner_mode,
+                                        landmark_table=self.landmark_table,
+                                        contraction_hierarchy=self.contraction_hierarchy,
+                                        route_cache=self.route_cache,
+                                        compact_graph=self.compact_graph,
+                                        time_budget=self.path_time_budget)
+        if self.reservation_table is not None:
+            # the node ids changed with the graph
+            self.reservation_table = ReservationTable(self.collision_matrix,
+                                                      slot_duration=self.reservation_table.slot_duration,
+                                                      horizon=self.reservation_table.horizon)
+        if self.planning_pool is not None:
+            # the workers hold a copy of the old planner
+            self.set_parallel_planning(self.planning_pool.processes)
         return
 
+    def _build_landmark_table(self):
+        return LandmarkTable(self.compact_graph, num_landmarks=self.num_landmarks)
+
+    def set_planner_mode(self, mode, num_landmarks=8):
+        """ Selects the search of every duckie planner, see PathPlanner for the modes, the landmark
+        table of the 'alt' mode and the contraction hierarchy of the 'ch' mode are built once for
+        the current graph and shared
+        """
+        if mode not in PathPlanner.modes:
+            raise ValueError('Unknown planner mode %s, expected one of %s' % (mode, PathPlanner.modes))
+        self.planner_mode = mode
+        if mode == 'alt' and (self.landmark_table is None or self.num_landmarks != num_landmarks):
+            self.num_landmarks = num_landmarks
+            self.landmark_table = self._build_landmark_table()
+        if mode == 'ch' and self.contraction_hierarchy is None:
+            self.contraction_hierarchy = ContractionHierarchy(self.compact_graph)
+        self.path_planner.set_mode(mode, self.landmark_table, self.contraction_hierarchy)
+        for duckie in self.duckie_citizens:
+            duckie.path_planner.set_mode(mode, self.landmark_table, self.contraction_hierarchy)
+        if self.planning_pool is not None:
+            self.set_parallel_planning(self.planning_pool.processes)
+
+    def set_planning_time_budget(self, path_time_budget=None, profile_time_budget=None):
+        """ Bounds the time of every search and velocity profile of the duckies (e.g. to fit the tick
+        of a control loop), None for no limit, see PathPlanner and VelocityProfiler for what is returned
+        when the budget is over
+        """
+        self.path_time_budget = path_time_budget
+        self.profile_time_budget = profile_time_budget
+        self.path_planner.time_budget = path_time_budget
+        for duckie in self.duckie_citizens:
+            duckie.path_planner.time_budget = path_time_budget
+            duckie.velocity_profiler.time_budget = profile_time_budget
+        if self.planning_pool is not None:
+            self.set_parallel_planning(self.planning_pool.processes)
+
+    def set_profile_horizon(self, horizon=None):
+        """ Makes the duckies profile their velocities only for the next horizon nodes of their paths
+        and extend the profile as they move, None to profile the whole paths, see VelocityProfiler
+        """
+        self.profile_horizon = horizon
+        for duckie in self.duckie_citizens:
+            duckie.velocity_profiler.horizon = horizon
+
+    def set_max_velocity_change(self, max_velocity_change=None):
+        """ Bounds the velocity change of the duckies between two path nodes of their profiles (their
+        acceleration over a lattice edge), None for any change, see VelocityProfiler
+        """
+        self.max_velocity_change = max_velocity_change
+        for duckie in self.duckie_citizens:
+            duckie.velocity_profiler.max_velocity_change = max_velocity_change
+
+    def get_cache_stats(self):
+        """ Sizes and hit rates of the caches shared by the planners and the profilers of the duckies """
+        return {'routes': self.route_cache.get_stats(), 'profiles': self.profile_cache.get_stats()}
+
+    def set_parallel_planning(self, processes=None, enabled=True):
+        """ In the parallel planning the replans of the duckies of a step (path and velocity profile)
+        run on a PlanningPool of processes workers holding a copy of the town planner, and are applied
+        in the duckie order. They are planned from the state at the beginning of the step, the
+        duckies moved before in the same step are seen where they were. The cooperative planning
+        stays sequential, every plan depends on the reservations of the previous ones, and so does
+        the 'dstar_lite' planner mode, its search state is kept by the planner of every duckie.
+        The workers run until close
+        """
+        self.close()
+        if enabled:
+            self.planning_pool = PlanningPool(self.path_planner, processes=processes)
+
+    def close(self):
+        """ Stops the workers of the parallel planning, if any, the town can also be used in a with
+        statement closing it at the end
+        """
+        if self.planning_pool is not None:
+            self.planning_pool.close()
+            self.planning_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_cooperative_planning(self, enabled=True, slot_duration=0.2, horizon=10.):
+        """ In the cooperative planning every duckie reserves the (node, time slot) of its path and
+        velocity profile in a table shared by the town, the later plans search in space-time around
+        these reservations. A duckie profiles its path again at every control point, drives a profile
+        whose windows are free and replans only when an observed duckie is on its path or none is.
+        Otherwise every duckie replans as soon as it observes another one
+        slot_duration, horizon: see ReservationTable
+        """
+        self.reservation_table = None
+        if enabled:
+            self.reservation_table = ReservationTable(self.collision_matrix, slot_duration=slot_duration,
+                                                      horizon=horizon)
+        for duckie in self.duckie_citizens:
+            duckie.reservation_table = self.reservation_table
+
     def get_map(self):
         return self.original_map
 
@@ -115,6 +336,9 @@ class DuckieTown(object):
 
     def draw_map_with_lanes(self):
         from duckietown_world.svg_drawing.ipython_utils import ipython_draw_html
+        if self.skeleton_graph.root2 is None:
+            # loaded from the map cache without the drawing roots
+            self.skeleton_graph = segmentify.get_skeleton_graph(self.original_map)
         ipython_draw_html(self.skeleton_graph.root2)
         return
 
@@ -124,16 +348,28 @@ class DuckieTown(object):
                             CONSTANTS.duckie_height,
                             velocity=0.25,
                             position=SE2_location)
-        for duckie in self.duckie_citizens:
-            if is_bounding_boxes_intersect(duckie.get_duckie_safe_bounding_box(),
-                                           new_duckie.get_duckie_safe_bounding_box()):
+        for duckie in self._get_duckies_around(new_duckie):
+            if are_convex_polygons_intersecting(duckie.get_duckie_safe_bounding_box_corners(),
+                                                new_duckie.get_duckie_safe_bounding_box_corners()):
                 print("The duckie you are trying to spawn doesn't make duckietown safer, it collides with others")
                 return
         new_duckie.map_environment(self.current_graph,
                                    self.node_to_index,
                                    self.index_to_node,
-                                   self.collision_matrix)
-        self.duckie_citizens.append(new_duckie)
+                                   self.collision_matrix,
+                                   node_index=self.node_index,
+                                   planner_mode=self.planner_mode,
+                                   landmark_table=self.landmark_table,
+                                   contraction_hierarchy=self.contraction_hierarchy,
+                                   route_cache=self.route_cache,
+                                   compact_graph=self.compact_graph,
+                                   reservation_table=self.reservation_table,
+                                   path_time_budget=self.path_time_budget,
+                                   profile_time_budget=self.profile_time_budget,
+                                   profile_horizon=self.profile_horizon,
+                                   max_velocity_change=self.max_velocity_change,
+                                   profile_cache=self.profile_cache)
+        self._add_duckie(new_duckie)
         self.update_blocked_nodes()
         return
 
@@ -151,64 +387,82 @@ class DuckieTown(object):
                                     CONSTANTS.duckie_height,
                                     velocity=0.25,
                                     position=random_node['point'])
-                for duckie in self.duckie_citizens:
-                    if is_bounding_boxes_intersect(duckie.get_duckie_safe_bounding_box(),
-                                                   new_duckie.get_duckie_safe_bounding_box()):
+                for duckie in self._get_duckies_around(new_duckie):
+                    if are_convex_polygons_intersecting(duckie.get_duckie_safe_bounding_box_corners(),
+                                                        new_duckie.get_duckie_safe_bounding_box_corners()):
                         new_duckie = None
                         break
             new_duckie.map_environment(self.current_graph,
                                        self.node_to_index,
                                        self.index_to_node,
-                                       self.collision_matrix)#takes a lot of time for now TODO: need to be optimized
-            self.duckie_citizens.append(new_duckie)
+                                       self.collision_matrix,
+                                       node_index=self.node_index,
+                                       planner_mode=self.planner_mode,
+                                       landmark_table=self.landmark_table,
+                                       contraction_hierarchy=self.contraction_hierarchy,
+                                       route_cache=self.route_cache,
+                                       compact_graph=self.compact_graph,
+                                       reservation_table=self.reservation_table,
+                                       path_time_budget=self.path_time_budget,
+                                       profile_time_budget=self.profile_time_budget,
+                                       profile_horizon=self.profile_horizon,
+                                       max_velocity_change=self.max_velocity_change,
+                                       profile_cache=self.profile_cache)
+            self._add_duckie(new_duckie)
         self.update_blocked_nodes()
         return
 
+    def _add_duckie(self, duckie):
+        self.duckie_citizens.append(duckie)
+        self.duckie_grid.insert(duckie.id, duckie.get_current_positon().p)
+        # the grid follows every pose change, the ones of step and the ones set from outside alike
+        duckie.pose_listener = self._on_duckie_moved
+
+    def _on_duckie_moved(self, duckie):
+        self.duckie_grid.update(duckie.id, duckie.get_current_positon().p)
+
+    def _get_duckies_around(self, duckie):
+        # broad phase, only the duckies whose box can reach the field of view of this one
+        candidate_ids = self.duckie_grid.query(duckie.get_current_positon().p, duckie.get_max_radius())
+        return [self.duckie_citizens[candidate_id] for candidate_id in candidate_ids]
+
     def get_duckie_citizens(self):
         return self.duckie_citizens
 
     def get_duckie(self, duckie_id):
         return self.duckie_citizens[duckie_id]
 
+    def _get_cluster_nodes_in_polygon(self, duckie, local_polygon):
+        # all the candidate nodes are moved to the duckie frame at once and tested in bulk
+        cluster = self.foot_print_table.get_cluster(duckie.get_closest_node())
+        position = duckie.get_current_positon()
+        local_points = to_local_frame(self.node_index.positions[cluster], position.p, position.theta)
+        inside = cluster[are_points_in_convex_polygon(local_points, local_polygon)]
+        nodes = []
+        for index in inside:
+            node_name = self.index_to_node[index]
+            nodes.append((node_name, self.current_graph.nodes[node_name]))
+        return nodes
+
     def get_duckie_foot_print(self, duckie_id):
-        foot_print = []
-        #replacing looping over nodes to looping over cluster
-        # for node in self.current_graph.nodes(data=True):
-        #     node_data = node[1]
-        #     if is_point_in_bounding_box(node_data['point'],
-        #                                 self.duckie_citizens[duckie_id].get_duckie_bounding_box()):
-        #         foot_print.append(node)
-        closest_node = self.duckie_citizens[duckie_id].get_closest_node()
-        for node_name in self.clustered_graph[closest_node]:
-            node_data = self.current_graph.nodes(data=True)[node_name]
-            if is_point_in_bounding_box(node_data['point'],
-                                        self.duckie_citizens[duckie_id].get_duckie_bounding_box()):
-                foot_print.append((node_name, node_data))
-        return foot_print
+        duckie = self.duckie_citizens[duckie_id]
+        return self._get_cluster_nodes_in_polygon(duckie, duckie.get_local_bounding_box())
 
     def get_duckie_safe_foot_print(self, duckie_id):
-        safe_foot_print = []
-        closest_node = self.duckie_citizens[duckie_id].get_closest_node()
-        for node_name in self.clustered_graph[closest_node]:
-            node_data = self.current_graph.nodes(data=True)[node_name]
-            if is_point_in_bounding_box(node_data['point'],
-                                        self.duckie_citizens[duckie_id].get_duckie_safe_bounding_box()):
-                safe_foot_print.append((node_name, node_data))
-        return safe_foot_print
+        duckie = self.duckie_citizens[duckie_id]
+        return self._get_cluster_nodes_in_polygon(duckie, duckie.get_local_safe_bounding_box())
 
     def get_duckie_current_frame(self, duckie_id):
         # get observed duckies
         observed_duckies = []
-        for duckie in self.duckie_citizens:
-            if duckie != self.duckie_citizens[duckie_id] and is_bounding_boxes_intersect(duckie.get_duckie_bounding_box(), self.duckie_citizens[duckie_id].get_field_of_view()):
+        field_of_view = self.duckie_citizens[duckie_id].get_field_of_view_corners()
+        for duckie in self._get_duckies_around(self.duckie_citizens[duckie_id]):
+            if duckie != self.duckie_citizens[duckie_id] and \
+                    are_convex_polygons_intersecting(duckie.get_duckie_bounding_box_corners(), field_of_view):
                 observed_duckies.append(duckie)
         # get observed nodes
-        observed_nodes = []
-        closest_node = self.duckie_citizens[duckie_id].get_closest_node()
-        for node_name in self.clustered_graph[closest_node]:
-            node_data = self.current_graph.nodes(data=True)[node_name]
-            if is_point_in_bounding_box(node_data['point'], self.duckie_citizens[duckie_id].get_field_of_view()):
-                observed_nodes.append((node_name, node_data))
+        duckie = self.duckie_citizens[duckie_id]
+        observed_nodes = self._get_cluster_nodes_in_polygon(duckie, duckie.get_local_field_of_view())
         return observed_duckies, observed_nodes
 
     def issue_ticket(self, duckie_id):
@@ -228,24 +482,52 @@ class DuckieTown(object):
         print('current occupied nodes are ', nodes_SE2)
         return nodes_SE2
 
+    def _plan_moves_in_parallel(self, moving_duckies):
+        """ Starts the moves of moving_duckies and plans their replans on the planning pool,
+        returns the duckies that still have a path to follow
+        """
+        following_duckies = []
+        replanning_duckies = []
+        requests = []
+        for duckie in moving_duckies:
+            if not duckie.start_move():
+                continue
+            following_duckies.append(duckie)
+            if duckie.replan:
+                replanning_duckies.append(duckie)
+                requests.append(duckie.get_replan_request())
+        for duckie, (path_node_names, velocity_profile) in zip(replanning_duckies,
+                                                                self.planning_pool.plan(requests)):
+            duckie.set_planned_path(path_node_names, velocity_profile)
+        return set(duckie.id for duckie in following_duckies if len(duckie.current_path) > 0)
+
     def step(self, time_in_seconds, display=False, save=False, folder='./data', file_index=0):
-        for duckie in self.duckie_citizens:
-            if not duckie.is_stationary():
-                time1 = time.time()
+        moving_duckies = [duckie for duckie in self.duckie_citizens if not duckie.is_stationary()]
+        following_duckie_ids = None
+        if self.planning_pool is not None and self.reservation_table is None and \
+                self.planner_mode != 'dstar_lite':
+            following_duckie_ids = self._plan_moves_in_parallel(moving_duckies)
+        for duckie in moving_duckies:
+            time1 = time.time()
+            if following_duckie_ids is None:
                 duckie.move(time_in_seconds)
-                time2 = time.time()
-                observed_duckies, observed_nodes = self.get_duckie_current_frame(duckie.id)
-                time3 = time.time()
-                foot_print = self.get_duckie_foot_print(duckie.id)
-                time4 = time.time()
-                safe_foot_print = self.get_duckie_safe_foot_print(duckie.id)
-                time5 = time.time()
-                duckie.set_current_frame(observed_duckies, observed_nodes)
-                time6 = time.time()
-                duckie.set_foot_print(foot_print)
-                time7 = time.time()
-                duckie.set_safe_foot_print(safe_foot_print)
-                time8 = time.time()
+            elif duckie.id in following_duckie_ids:
+                duckie.finish_move(time_in_seconds)
+            time2 = time.time()
+            observed_duckies, observed_nodes = self.get_duckie_current_frame(duckie.id)
+            time3 = time.time()
+            foot_print = self.get_duckie_foot_print(duckie.id)
+            time4 = time.time()
+            safe_foot_print = self.get_duckie_safe_foot_print(duckie.id)
+            time5 = time.time()
+            duckie.set_current_frame(observed_duckies, observed_nodes)
+            time6 = time.time()
+            duckie.set_foot_print(foot_print)
+            time7 = time.time()
+            duckie.set_safe_foot_print(safe_foot_print)
+            time8 = time.time()
+        if self.reservation_table is not None:
+            self.reservation_table.advance(time_in_seconds)
         self.update_blocked_nodes()
         if display or save:
             self.render_current_graph(display=display,
@@ -268,66 +550,33 @@ class DuckieTown(object):
         return
 
     def create_random_targets_for_all_duckies(self):
+        stationary_duckies = []
+        requests = []
         for duckie in self.duckie_citizens:
             if duckie.is_stationary():
                 _, random_end_node_name = self.get_random_node_in_graph()
-                duckie.set_target_destination(random_end_node_name)
+                stationary_duckies.append(duckie)
+                requests.append((duckie.get_closest_node(), random_end_node_name, []))
+        if self.reservation_table is None:
+            paths = self.plan_paths(requests)
+        else:
+            # planned one after the other, each path avoids the reservations of the previous ones
+            paths = [None] * len(requests)
+        for duckie, (_, end_node_name, _), path in zip(stationary_duckies, requests, paths):
+            duckie.set_target_destination(end_node_name, path=path)
         return
 
+    def plan_paths(self, requests):
+        """ Plans the (start, end, occupancy_node_names) requests of a step together with the town
+        planner, the requests sharing an occupancy share one masked search, see
+        PathPlanner.get_shortest_paths
+        """
+        return self.path_planner.get_shortest_paths(requests)
+
     def is_duckie_violating(self, duckie):
         raise Exception('DuckieTown is_duckie_violating not implemented')
 
     def _build_collision_matrix(self):
-        from shapely.geometry.polygon import Polygon
-
-        def get_bounding_box(center_point):
-            # BB ll, lr, ul, ur
-            bounding_box = []
-            # lower_right
-            relative_transform = geo.SE2_from_translation_angle([-CONSTANTS.duckie_width / 2, -CONSTANTS.duckie_height / 2], 0)
-            transform = geo.SE2.multiply(center_point.as_SE2(), relative_transform)
-            bounding_box.append(SE2Transform.from_SE2(transform))
-            # lower_left
-            relative_transform = geo.SE2_from_translation_angle([CONSTANTS.duckie_width / 2, -CONSTANTS.duckie_height / 2], 0)
-            transform = geo.SE2.multiply(center_point.as_SE2(), relative_transform)
-            bounding_box.append(SE2Transform.from_SE2(transform))
-            # upper left
-            relative_transform = geo.SE2_from_translation_angle([CONSTANTS.duckie_width / 2, CONSTANTS.duckie_height / 2], 0)
-            transform = geo.SE2.multiply(center_point.as_SE2(), relative_transform)
-            bounding_box.append(SE2Transform.from_SE2(transform))
-            # upper right
-            relative_transform = geo.SE2_from_translation_angle([-CONSTANTS.duckie_width / 2, CONSTANTS.duckie_height / 2], 0)
-            transform = geo.SE2.multiply(center_point.as_SE2(), relative_transform)
-            bounding_box.append(SE2Transform.from_SE2(transform))
-
-            return bounding_box
-
-        # def local_to_global(poly_points, q):
-        #     global_points = []
-        #     for points in poly_points:
-        #         q_point = geo.SE2_from_translation_angle(points, 0.0)
-        #         global_point, _ = geo.translation_angle_from_SE2(geo.SE2.multiply(q, q_point))
-        #         global_points.append(global_point)
-        #
-        #     return global_points
-
-        def overlap(q1, q2):
-            # poly_points = ([((CONSTANTS.duckie_height / 2.0), (-CONSTANTS.duckie_width / 2.0)),
-            #                 ((CONSTANTS.duckie_height / 2.0), (CONSTANTS.duckie_width / 2.0)),
-            #                 ((-CONSTANTS.duckie_height / 2.0), (CONSTANTS.duckie_width / 2.0)),
-            #                 ((-CONSTANTS.duckie_height / 2.0), (-CONSTANTS.duckie_width / 2.0))])
-            return 1 if is_bounding_boxes_intersect(get_bounding_box(q1), get_bounding_box(q2)) else 0
-
-        num_nodes = len(self.current_graph)
-        collision_matrix = [[0 for _ in range(num_nodes)] for _ in range(num_nodes)]
-
-        for i in range(num_nodes):
-            curr = self.current_graph.nodes[self.index_to_node[i]]['point']
-            collision_matrix[i][i] = 1
-            for j in range(i+1, num_nodes):
-                q = self.current_graph.nodes[self.index_to_node[j]]['point']
-                collision = overlap(curr, q)
-                collision_matrix[i][j] = collision
-                collision_matrix[j][i] = collision
-
-        return np.array(collision_matrix)
+        return build_collision_matrix(self.node_index.positions, self.node_index.thetas,
+                                      CONSTANTS.duckie_width,
+                                      CONSTANTS.duckie_height)
@@ -3,33 +3,43 @@ __all__ = [
     'FootprintTable',
 ]
 
+import itertools
 import numpy as np
+from duckietown_uplan.environment.spatial_index import NodeIndex
 
 
 class FootprintTable(object):
+    """ For every node, the indices of the nodes closer than radius. The neighborhoods are
+    found with one batched radius query on the node index and stored back to back in a
+    single integer array, cluster k being indices[indptr[k]:indptr[k + 1]]
+    indptr, indices: previously built arrays (e.g. from a MapCache), skips the radius queries
+    """
 
-    def __init__(self, graph, radius):
+    def __init__(self, graph, radius, node_index=None, indptr=None, indices=None):
         self.graph = graph
         self.radius = radius
-        self.data = {}
-        self.create_dictionary()
-
-    def in_radius(self, center_node):
-        nodes_in_radius = []
-        center_point = self.graph.node[center_node]["point"]
-        for node in self.graph.nodes():
-            point= self.graph.node[node]["point"]
-            if self.get_euclidean_distance(center_point, point) < self.radius:
-                nodes_in_radius.append(node)
-        return nodes_in_radius
+        if node_index is None:
+            node_index = NodeIndex(graph)
+        self.node_index = node_index
+        self.indptr = indptr
+        self.indices = indices
+        if self.indptr is None or self.indices is None:
+            self.create_dictionary()
 
     def create_dictionary(self):
-        for node in self.graph.nodes():
-            self.data[node] = self.in_radius(node)
-
-    def get_data(self):
-        return self.data
-
-    @staticmethod
-    def get_euclidean_distance(point1, point2):
-        return np.linalg.norm(point1.p - point2.p)
+        # strictly closer than radius
+        neighborhoods = self.node_index.tree.query_ball_point(self.node_index.positions,
+                                                             np.nextafter(self.radius, 0))
+        sizes = np.array([len(neighborhood) for neighborhood in neighborhoods], dtype=np.int64)
+        self.indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.indptr[1:])
+        self.indices = np.fromiter(itertools.chain.from_iterable(neighborhoods),
+                                   dtype=np.int32, count=self.indptr[-1])
+
+    def get_cluster(self, node_name):
+        """ Returns the indices, in the node index order, of the nodes around node_name """
+        k = self.node_index.node_to_index[node_name]
+        return self.indices[self.indptr[k]:self.indptr[k + 1]]
+
+    def get_cluster_names(self, node_name):
+        return [self.node_index.node_names[index] for index in self.get_cluster(node_name)]
@@ -0,0 +1,154 @@
+"""
+This class is supposed to keep the preprocessed map artifacts on disk between runs
+"""
+__all__ = [
+    'MapCache',
+]
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import duckietown_world as dw
+from duckietown_world.geo.measurements_utils import iterate_by_class
+from duckietown_world.world_duckietown.lane_segment import LaneSegment
+from duckietown_uplan.environment.constant import Constants as CONSTANTS
+
+# sha1 of the source files building the cached artifacts, computed once per process
+_source_digest = None
+
+
+class MapCache(object):
+    """ Content addressed cache of the graphs and arrays built from a map, an entry is a folder
+    named after the sha1 of the lane segments of the map, the preprocessing parameters, the
+    duckie dimensions, the duckietown_world version and the source of the modules doing the
+    preprocessing, so editing them does not load stale entries. Every array is a .npy file
+    opened memory mapped, the python objects (graphs, node names) are pickled and loaded in
+    full by every run
+    cache_dir: root folder, defaults to $DUCKIETOWN_UPLAN_CACHE or ~/.cache/duckietown_uplan
+    """
+    # bump when the layout of an entry changes, the preprocessing itself is covered by source_files
+    format_version = 1
+    objects_file = 'objects.pickle'
+    # the modules, relative to the package, whose code ends up in the graphs and the arrays
+    source_files = ['graph_utils/augmentation.py',
+                    'graph_utils/constants.py',
+                    'graph_utils/segmentify.py',
+                    'environment/collision.py',
+                    'environment/constant.py',
+                    'environment/duckie.py',
+                    'environment/duckie_town.py',
+                    'environment/footprint_table.py',
+                    'environment/spatial_index.py',
+                    'environment/utils.py']
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('DUCKIETOWN_UPLAN_CACHE',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'duckietown_uplan'))
+        self.cache_dir = cache_dir
+        self.source_digest = self.get_source_digest()
+
+    @classmethod
+    def get_source_digest(cls):
+        global _source_digest
+        if _source_digest is None:
+            package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            digest = hashlib.sha1()
+            for source_file in cls.source_files:
+                digest.update(source_file.encode('utf-8'))
+                with open(os.path.join(package_dir, *source_file.split('/')), 'rb') as source:
+                    digest.update(source.read())
+            _source_digest = digest.hexdigest()
+        return _source_digest
+
+    @staticmethod
+    def get_map_digest(map):
+        """ Hashes what the graphs are built from: the pose, the width and the control points
+        of every lane segment, in the map order
+        """
+        digest = hashlib.sha1()
+        digest.update(repr(float(map.tile_size)).encode('utf-8'))
+        for it in iterate_by_class(map, LaneSegment):
+            lane_segment = it.object
+            digest.update(repr(it.fqn).encode('utf-8'))
+            digest.update(np.ascontiguousarray(it.transform_sequence.asmatrix2d().m, dtype='float64').tobytes())
+            digest.update(repr(float(lane_segment.width)).encode('utf-8'))
+            for control_point in lane_segment.control_points:
+                digest.update(np.ascontiguousarray(control_point.p, dtype='float64').tobytes())
+                digest.update(repr(float(control_point.theta)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_key(self, map_digest, stage, **params):
+        """ Key of the artifacts built from the map with digest map_digest at stage
+        (e.g. 'skeleton', 'augmented') with params
+        """
+        digest = hashlib.sha1()
+        digest.update(map_digest.encode('utf-8'))
+        description = [('format_version', self.format_version),
+                       ('source_digest', self.source_digest),
+                       ('duckietown_world', dw.__version__),
+                       ('stage', stage),
+                       ('duckie_width', CONSTANTS.duckie_width),
+                       ('duckie_height', CONSTANTS.duckie_height),
+                       ('FOV_vertical', CONSTANTS.FOV_vertical),
+                       ('FOV_horizontal', CONSTANTS.FOV_horizontal)]
+        description += sorted(params.items())
+        digest.update(repr(description).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def has(self, key):
+        return os.path.isfile(os.path.join(self._get_entry_path(key), self.objects_file))
+
+    def load(self, key):
+        """ Returns (objects, arrays) of the entry, the arrays being read only memory maps,
+        or None if the entry does not exist
+        """
+        if not self.has(key):
+            return None
+        entry_path = self._get_entry_path(key)
+        with open(os.path.join(entry_path, self.objects_file), 'rb') as objects_file:
+            objects = pickle.load(objects_file)
+        arrays = {}
+        for file_name in os.listdir(entry_path):
+            name, extension = os.path.splitext(file_name)
+            if extension == '.npy':
+                arrays[name] = np.load(os.path.join(entry_path, file_name), mmap_mode='r')
+        return objects, arrays
+
+    def save(self, key, objects, arrays):
+        """ Writes the entry in a temporary folder first and renames it, so concurrent
+        runs never see a half written entry
+        """
+        if self.has(key):
+            return
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        temp_path = tempfile.mkdtemp(prefix='.' + key, dir=self.cache_dir)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(temp_path, name + '.npy'), np.ascontiguousarray(array))
+            # the objects are written last, they mark the entry as complete
+            with open(os.path.join(temp_path, self.objects_file), 'wb') as objects_file:
+                pickle.dump(objects, objects_file, protocol=2)
+            os.rename(temp_path, self._get_entry_path(key))
+        except OSError:
+            # another run stored the same entry in the meantime
+            if not self.has(key):
+                raise
+        finally:
+            if os.path.isdir(temp_path):
+                shutil.rmtree(temp_path)
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
@@ -0,0 +1,58 @@
+"""
+This class is supposed to answer the spatial queries over the nodes of a graph
+"""
+__all__ = [
+    'NodeIndex',
+]
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class NodeIndex(object):
+    """ KD-tree over the node positions of a graph, built once and shared by all the duckies
+    graph: graph whose nodes carry a 'point' SE2Transform
+    node_names: order of the nodes in the index, defaults to the graph order
+    node_to_index, positions, thetas: the mapping and the poses of node_names if they are
+    already built (e.g. shared with a CompactGraph), read from the graph otherwise
+    """
+    tie_tolerance = 1e-9
+
+    def __init__(self, graph, node_names=None, node_to_index=None, positions=None, thetas=None):
+        if node_names is None:
+            node_names = list(graph.nodes())
+        self.node_names = list(node_names)
+        if node_to_index is None:
+            node_to_index = {name: i for i, name in enumerate(self.node_names)}
+        self.node_to_index = node_to_index
+        if positions is None or thetas is None:
+            positions = np.zeros((len(self.node_names), 2))
+            thetas = np.zeros(len(self.node_names))
+            for i, name in enumerate(self.node_names):
+                point = graph.nodes[name]['point']
+                positions[i] = point.p
+                thetas[i] = point.theta
+        self.positions = positions
+        self.thetas = thetas
+        self.tree = cKDTree(self.positions)
+
+    def __len__(self):
+        return len(self.node_names)
+
+    def get_closest_node(self, location_SE2):
+        distance, index = self.tree.query(location_SE2.p)
+        # several nodes can share a position (different headings), keep the first one like a linear scan
+        candidates = self.tree.query_ball_point(location_SE2.p, distance + self.tie_tolerance)
+        if len(candidates) > 1:
+            distances = [(np.linalg.norm(location_SE2.p - self.positions[candidate]), candidate)
+                         for candidate in candidates]
+            distance, index = min(distances)
+        return self.node_names[index], distance
+
+    def get_k_closest_nodes(self, location_SE2, k):
+        """ Returns the k closest (node_name, distance) sorted by distance """
+        k = min(k, len(self.node_names))
+        distances, indices = self.tree.query(location_SE2.p, k=k)
+        distances = np.atleast_1d(distances)
+        indices = np.atleast_1d(indices)
+        return [(self.node_names[index], distance) for index, distance in zip(indices, distances)]
@@ -108,7 +108,9 @@ def create_graph_from_nodes(nodes):
     return bb_graph
 
 
-def get_closest_neighbor(graph, node_location):
+def get_closest_neighbor(graph, node_location, node_index=None):
+    if node_index is not None:
+        return node_index.get_closest_node(node_location)
     closest_node_name = None
     min_distance = float('inf')
     for neighbor in graph.nodes(data=True):
@@ -2,3 +2,4 @@
 from .augmentation import *
 from .segmentify import *
 from .constants import *
+from .compact_graph import *
@@ -0,0 +1,127 @@
+"""
+Frozen array representation of a graph for the planning hot paths
+"""
+__all__ = [
+    'CompactGraph',
+]
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class CompactGraph(object):
+    """ Built once from a (multi)digraph whose nodes carry a 'point' SE2Transform. Nodes get the
+    integer ids 0..N-1, the successors of node k are indices[indptr[k]:indptr[k + 1]] with the
+    weights at the same positions (cheapest of the parallel edges), the predecessors are stored
+    the same way. All the arrays are read only
+    node_names: order of the ids, defaults to the graph order
+    weight: edge attribute of the weights, 1 when missing like networkx
+    node_to_id, positions, headings: the mapping and the poses of node_names if they are already
+    built (e.g. shared with a NodeIndex), read from the graph otherwise
+    """
+    def __init__(self, graph, node_names=None, weight='dist', node_to_id=None, positions=None, headings=None):
+        if node_names is None:
+            node_names = list(graph.nodes())
+        self.node_names = tuple(node_names)
+        if node_to_id is None:
+            node_to_id = {name: node_id for node_id, name in enumerate(self.node_names)}
+        self.node_to_id = node_to_id
+        num_nodes = len(self.node_names)
+
+        if positions is None or headings is None:
+            positions = np.zeros((num_nodes, 2))
+            headings = np.zeros(num_nodes)
+            for node_id, name in enumerate(self.node_names):
+                point = graph.nodes[name]['point']
+                positions[node_id] = point.p
+                headings[node_id] = point.theta
+        self.positions = positions
+        self.headings = headings
+        sources = []
+        targets = []
+        weights = []
+        for node_id, name in enumerate(self.node_names):
+            # same successor order as the graph, Dijkstra breaks the ties like networkx
+            for successor, edges in graph.succ[name].items():
+                sources.append(node_id)
+                targets.append(self.node_to_id[successor])
+                weights.append(min(attr.get(weight, 1) for attr in edges.values()))
+        sources = np.array(sources, dtype=np.int64)
+        targets = np.array(targets, dtype=np.int64)
+        weights = np.array(weights, dtype=np.float64)
+
+        self.indptr, self.indices, self.weights = self._to_csr(sources, targets, weights, num_nodes)
+        self.pred_indptr, self.pred_indices, self.pred_weights = self._to_csr(targets, sources, weights, num_nodes)
+        for array in (self.positions, self.headings, self.indptr, self.indices, self.weights,
+                      self.pred_indptr, self.pred_indices, self.pred_weights):
+            array.setflags(write=False)
+        self.successor_lists = None
+        self.predecessor_lists = None
+        self.position_list = None
+
+    @staticmethod
+    def _to_csr(rows, cols, weights, num_nodes):
+        # stable sort keeps the original order of the edges of each row
+        order = np.argsort(rows, kind='mergesort')
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+        return indptr, cols[order].astype(np.int32), weights[order]
+
+    def __len__(self):
+        return len(self.node_names)
+
+    def get_num_edges(self):
+        return len(self.indices)
+
+    def get_id(self, node_name):
+        try:
+            return self.node_to_id[node_name]
+        except KeyError:
+            raise nx.NodeNotFound('Node {} is not in the graph'.format(node_name))
+
+    def get_ids(self, node_names):
+        return [self.get_id(node_name) for node_name in node_names]
+
+    def get_name(self, node_id):
+        return self.node_names[node_id]
+
+    def get_names(self, node_ids):
+        return [self.node_names[node_id] for node_id in node_ids]
+
+    def get_successors(self, node_id):
+        """ Returns the (ids, weights) arrays of the edges leaving node_id """
+        start, end = self.indptr[node_id], self.indptr[node_id + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+    def get_predecessors(self, node_id):
+        """ Returns the (ids, weights) arrays of the edges entering node_id """
+        start, end = self.pred_indptr[node_id], self.pred_indptr[node_id + 1]
+        return self.pred_indices[start:end], self.pred_weights[start:end]
+
+    def get_successor_lists(self):
+        """ Plain lists [(id, weight)] per node, faster than the arrays in a pure python search """
+        if self.successor_lists is None:
+            self.successor_lists = self._to_lists(self.indptr, self.indices, self.weights)
+        return self.successor_lists
+
+    def get_predecessor_lists(self):
+        if self.predecessor_lists is None:
+            self.predecessor_lists = self._to_lists(self.pred_indptr, self.pred_indices, self.pred_weights)
+        return self.predecessor_lists
+
+    @staticmethod
+    def _to_lists(indptr, indices, weights):
+        pairs = list(zip(indices.tolist(), weights.tolist()))
+        bounds = indptr.tolist()
+        return [pairs[bounds[k]:bounds[k + 1]] for k in range(len(bounds) - 1)]
+
+    def get_position_list(self):
+        """ Plain list of (x, y) per node """
+        if self.position_list is None:
+            self.position_list = [tuple(position) for position in self.positions.tolist()]
+        return self.position_list
+
+    def get_weight_matrix(self):
+        """ The weights as a scipy sparse matrix, e.g. for scipy.sparse.csgraph """
+        return csr_matrix((self.weights, self.indices, self.indptr), shape=(len(self), len(self)))
@@ -9,7 +9,7 @@ import duckietown_world as dw
 
 def main():
     current_map = dw.load_map('4way')
-    simulation_exp = uplan.ConstantProbabiltiySim(current_map, 10)
+    simulation_exp = uplan.ConstantProbabiltiySim(current_map, 10, map_cache=uplan.MapCache())
     simulation_exp.execute_simulation_video(30)
     # simulation_exp.execute_simulation(30)
 
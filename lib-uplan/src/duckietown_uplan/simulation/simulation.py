@@ -8,8 +8,8 @@ from duckietown_uplan.environment.duckie_town import DuckieTown
 
 
 class ConstantProbabiltiySim(object):
-    def __init__(self, current_map, number_of_duckies):
-        self.duckie_town = DuckieTown(current_map)
+    def __init__(self, current_map, number_of_duckies, map_cache=None):
+        self.duckie_town = DuckieTown(current_map, map_cache=map_cache)
         self.duckie_town.augment_graph()
         self.duckie_town.spawn_random_duckie(number_of_duckies)
         self.duckie_town.get_duckie(0).set_visible_path(True)
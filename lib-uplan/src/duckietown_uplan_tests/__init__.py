@@ -2,6 +2,19 @@
 
 # add an import for each test file in this directory
 from .test1 import *
+from .test_batch_planning import *
+from .test_broad_phase import *
+from .test_collision import *
+from .test_compact_graph import *
+from .test_cooperative_planning import *
+from .test_incremental_planning import *
+from .test_map_cache import *
+from .test_path_planning import *
+from .test_planning_pool import *
+from .test_route_cache import *
+from .test_spatial_index import *
+from .test_time_budget import *
+from .test_velocity_profiling import *
 # from .test2 import *
 
 
@@ -0,0 +1,36 @@
+# coding=utf-8
+import random
+from comptests import comptest, run_module_tests
+from duckietown_uplan_tests.utils import get_town, get_planner, get_path_cost, get_path_node_names
+
+
+@comptest
+def test_batch_planning_matches_single_requests():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(2)
+    starts = [random_state.choice(node_names) for _ in range(5)]
+    occupancies = [[], [random_state.choice(node_names) for _ in range(3)]]
+    requests = [(random_state.choice(starts), random_state.choice(node_names), random_state.choice(occupancies))
+                for _ in range(40)]
+    # without a route cache, the planner of the town would answer the single requests from the batch
+    reference_planner = get_planner(duckie_town)
+    expected_paths = [reference_planner.get_shortest_path(*request) for request in requests]
+    try:
+        for mode in ['dijkstra', 'astar']:
+            duckie_town.set_planner_mode(mode)
+            paths = duckie_town.plan_paths(requests)
+            for (start, _, __), path, expected_path in zip(requests, paths, expected_paths):
+                assert len(path) == len(expected_path) == 0 or abs(
+                    get_path_cost(graph, get_path_node_names(start, path)) -
+                    get_path_cost(graph, get_path_node_names(start, expected_path))) < 1e-9
+                if mode == 'dijkstra':
+                    # the batch runs the same Dijkstra as a single request, the ties are broken the same way
+                    assert [node_name for node_name, _ in path] == [node_name for node_name, _ in expected_path]
+    finally:
+        duckie_town.set_planner_mode('dijkstra')
+
+
+if __name__ == '__main__':
+    run_module_tests()
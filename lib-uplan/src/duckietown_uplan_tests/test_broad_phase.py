@@ -0,0 +1,50 @@
+# coding=utf-8
+import numpy as np
+import duckietown_world as dw
+from comptests import comptest, run_module_tests
+from duckietown_world.geo.transforms import SE2Transform
+from duckietown_uplan.environment.broad_phase import UniformGrid
+from duckietown_uplan.environment.duckie_town import DuckieTown
+
+
+def get_items_in_radius(positions, position, radius):
+    return sorted(item_id for item_id, item_position in positions.items()
+                  if np.linalg.norm(item_position - position) <= radius)
+
+
+@comptest
+def test_grid_queries_match_linear_scan():
+    random_state = np.random.RandomState(0)
+    grid = UniformGrid(cell_size=0.3)
+    positions = {}
+    for item_id in range(100):
+        positions[item_id] = random_state.rand(2) * 4 - 1
+        grid.insert(item_id, positions[item_id])
+    for _ in range(5):
+        for item_id in random_state.choice(list(positions.keys()), 30, replace=False):
+            positions[item_id] = positions[item_id] + random_state.normal(0, 0.3, 2)
+            grid.update(item_id, positions[item_id])
+        for item_id in random_state.choice(list(positions.keys()), 5, replace=False):
+            del positions[item_id]
+            grid.remove(item_id)
+        for _ in range(50):
+            position = random_state.rand(2) * 4 - 1
+            radius = random_state.rand() * 0.8
+            assert grid.query(position, radius) == get_items_in_radius(positions, position, radius)
+
+
+@comptest
+def test_grid_follows_duckies_moved_from_outside():
+    duckie_town = DuckieTown(dw.load_map('4way'))
+    duckie_town.augment_graph()
+    duckie_town.spawn_random_duckie(2)
+    duckie = duckie_town.get_duckie(0)
+    other_duckie = duckie_town.get_duckie(1)
+    # e.g. a pose from localization rather than from step
+    duckie.set_current_positon(SE2Transform(other_duckie.get_current_positon().p + [0.05, 0], 0))
+    assert duckie_town.duckie_grid.query(duckie.get_current_positon().p, 0) == [0]
+    assert other_duckie in duckie_town._get_duckies_around(duckie)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,80 @@
+# coding=utf-8
+import numpy as np
+from comptests import comptest, run_module_tests
+from duckietown_world.geo.transforms import SE2Transform
+from duckietown_uplan.environment.collision import build_collision_matrix, are_convex_polygons_intersecting, \
+    are_points_in_convex_polygon
+from duckietown_uplan.environment.duckie import Duckie
+from duckietown_uplan.environment.utils import transform_point, is_bounding_boxes_intersect, is_point_in_bounding_box
+
+
+@comptest
+def test_collision_matrix_matches_polygons():
+    width, height = 0.2, 0.1
+    random_state = np.random.RandomState(0)
+    positions = random_state.rand(60, 2)
+    thetas = random_state.rand(60) * 2 * np.pi
+    collision_matrix = build_collision_matrix(positions, thetas, width, height, block_size=16)
+
+    boxes = []
+    for p, theta in zip(positions, thetas):
+        center = SE2Transform(p, theta)
+        boxes.append([transform_point(center, dx, dy, 0) for dx, dy in [(-width / 2, -height / 2),
+                                                                       (width / 2, -height / 2),
+                                                                       (width / 2, height / 2),
+                                                                       (-width / 2, height / 2)]])
+    for i in range(len(boxes)):
+        for j in range(len(boxes)):
+            expected = 1 if is_bounding_boxes_intersect(boxes[i], boxes[j]) else 0
+            assert collision_matrix[i, j] == expected, (i, j)
+
+
+@comptest
+def test_field_of_view_intersection_matches_polygons():
+    random_state = np.random.RandomState(1)
+    duckies = [Duckie(i, 0.2, 0.1, 0.25, SE2Transform(random_state.rand(2) * 2, random_state.rand() * 2 * np.pi))
+               for i in range(30)]
+    for observer in duckies:
+        for duckie in duckies:
+            expected = is_bounding_boxes_intersect(duckie.get_duckie_bounding_box(), observer.get_field_of_view())
+            assert are_convex_polygons_intersecting(duckie.get_duckie_bounding_box_corners(),
+                                                    observer.get_field_of_view_corners()) == expected
+
+
+@comptest
+def test_points_in_polygon_match_polygons():
+    random_state = np.random.RandomState(2)
+    duckies = [Duckie(i, 0.2, 0.1, 0.25, SE2Transform(random_state.rand(2), random_state.rand() * 2 * np.pi))
+               for i in range(10)]
+    points = random_state.rand(200, 2) * 1.4 - 0.2
+    for duckie in duckies:
+        for polygon_SE2, corners in [(duckie.get_duckie_bounding_box(), duckie.get_duckie_bounding_box_corners()),
+                                     (duckie.get_field_of_view(), duckie.get_field_of_view_corners())]:
+            # the corners themselves are on the boundary, so outside
+            polygon_points = np.concatenate([points, np.asarray(corners)])
+            expected = [is_point_in_bounding_box(SE2Transform(point, 0), polygon_SE2) for point in polygon_points]
+            assert are_points_in_convex_polygon(polygon_points, corners).tolist() == expected
+            # and so are clockwise corners
+            assert are_points_in_convex_polygon(polygon_points, np.asarray(corners)[::-1]).tolist() == expected
+
+
+@comptest
+def test_moved_duckie_corners_are_recomputed():
+    random_state = np.random.RandomState(3)
+    duckie = Duckie(0, 0.2, 0.1, 0.25, SE2Transform(random_state.rand(2), random_state.rand() * 2 * np.pi))
+    for move in ['assignment', 'set_current_positon']:
+        # fills the cache at the current pose
+        duckie.get_duckie_bounding_box_corners()
+        duckie.get_field_of_view_corners()
+        position = SE2Transform(random_state.rand(2), random_state.rand() * 2 * np.pi)
+        if move == 'assignment':
+            duckie.current_position = position
+        else:
+            duckie.set_current_positon(position)
+        expected = Duckie(1, 0.2, 0.1, 0.25, position)
+        assert np.allclose(duckie.get_duckie_bounding_box_corners(), expected.get_duckie_bounding_box_corners())
+        assert np.allclose(duckie.get_field_of_view_corners(), expected.get_field_of_view_corners())
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,36 @@
+# coding=utf-8
+import numpy as np
+from comptests import comptest, run_module_tests
+from duckietown_uplan.graph_utils.compact_graph import CompactGraph
+from duckietown_uplan_tests.utils import get_town
+
+
+@comptest
+def test_compact_graph_matches_graph():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    compact_graph = CompactGraph(graph)
+    assert len(compact_graph) == len(graph)
+    for node_id, node_name in enumerate(compact_graph.node_names):
+        assert compact_graph.get_id(node_name) == node_id
+        np.testing.assert_array_equal(compact_graph.positions[node_id], graph.nodes[node_name]['point'].p)
+        successors, weights = compact_graph.get_successors(node_id)
+        assert compact_graph.get_names(successors) == list(graph.succ[node_name])
+        for successor, weight in zip(compact_graph.get_names(successors), weights):
+            assert weight == min(attr['dist'] for attr in graph[node_name][successor].values())
+        predecessors, _ = compact_graph.get_predecessors(node_id)
+        assert sorted(compact_graph.get_names(predecessors)) == sorted(graph.pred[node_name])
+
+
+@comptest
+def test_town_shares_node_mapping():
+    duckie_town = get_town()
+    # one name to index mapping and one pose array for the node index and the compact graph
+    assert duckie_town.compact_graph.node_to_id is duckie_town.node_to_index
+    assert duckie_town.node_index.node_to_index is duckie_town.node_to_index
+    assert duckie_town.compact_graph.positions is duckie_town.node_index.positions
+    assert duckie_town.compact_graph.headings is duckie_town.node_index.thetas
+
+
+if __name__ == '__main__':
+    run_module_tests()
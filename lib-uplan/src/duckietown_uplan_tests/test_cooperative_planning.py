@@ -0,0 +1,85 @@
+# coding=utf-8
+import random
+import duckietown_world as dw
+from comptests import comptest, run_module_tests
+from duckietown_uplan.environment.duckie_town import DuckieTown
+from duckietown_uplan.algo.reservation_table import ReservationTable
+from duckietown_uplan_tests.utils import get_town, get_path_cost
+
+
+@comptest
+def test_cooperative_paths_avoid_reservations():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    planner = duckie_town.path_planner
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(3)
+    speed = 0.3
+    for _ in range(20):
+        reservation_table = ReservationTable(duckie_town.collision_matrix)
+        start, end = random_state.choice(node_names), random_state.choice(node_names)
+        # nothing reserved yet, a shortest path
+        path = planner.get_cooperative_path(start, end, [], reservation_table, 0, speed)
+        reference_path = planner.get_shortest_path(start, end)
+        path_node_names = [start] + [node_name for node_name, _ in path]
+        assert len(path) == len(reference_path) == 0 or abs(
+            get_path_cost(graph, path_node_names) -
+            get_path_cost(graph, [start] + [node_name for node_name, _ in reference_path])) < 1e-9
+        arrival_times = [0.]
+        for u, v in zip(path_node_names, path_node_names[1:]):
+            arrival_times.append(arrival_times[-1] + get_path_cost(graph, [u, v]) / speed)
+        reservation_table.reserve(0, planner.compact_graph.get_ids(path_node_names), arrival_times)
+        other_start, other_end = random_state.choice(node_names), random_state.choice(node_names)
+        other_path = planner.get_cooperative_path(other_start, other_end, [], reservation_table, 1, speed)
+        other_path_node_names = [other_start] + [node_name for node_name, _ in other_path]
+        other_arrival_times = [0.]
+        for u, v in zip(other_path_node_names, other_path_node_names[1:]):
+            other_arrival_times.append(other_arrival_times[-1] + get_path_cost(graph, [u, v]) / speed)
+        # free for the whole time it holds every node, not only when it arrives there
+        assert len(other_path) == 0 or not reservation_table.is_path_reserved(
+            planner.compact_graph.get_ids(other_path_node_names), other_arrival_times, 1)
+    reservation_table.release(0)
+    assert len(reservation_table) == 0
+
+
+def assert_drives_own_windows(duckie, reservation_table, compact_graph):
+    """ The windows of the velocity profile the duckie drives are reserved by it alone """
+    node_names = [duckie.get_closest_node()] + [node_name for node_name, _ in duckie.current_path]
+    arrival_times = [reservation_table.current_time] + \
+        duckie.get_path_arrival_times(reservation_table.current_time)
+    node_ids = compact_graph.get_ids(node_names)
+    assert not reservation_table.is_path_reserved(node_ids, arrival_times, duckie.id)
+    assert all(duckie.id in reservation_table.slots[slot][node_id]
+               for node_id, start_slot, end_slot in reservation_table.get_windows(node_ids, arrival_times)
+               for slot in range(start_slot, end_slot + 1))
+
+
+@comptest
+def test_cooperative_duckies_drive_their_reservations():
+    duckie_town = DuckieTown(dw.load_map('4way'))
+    duckie_town.augment_graph()
+    duckie_town.set_cooperative_planning(slot_duration=0.2, horizon=10.)
+    reservation_table = duckie_town.reservation_table
+    random.seed(5)
+    duckie_town.spawn_random_duckie(4)
+    duckie_town.reset()
+    num_checks = 0
+    for _ in range(40):
+        planned_duckies = [duckie for duckie in duckie_town.get_duckie_citizens() if duckie.is_stationary()]
+        duckie_town.create_random_targets_for_all_duckies()
+        for duckie in planned_duckies:
+            if not duckie.replan and not duckie.is_stationary():
+                assert_drives_own_windows(duckie, reservation_table, duckie_town.compact_graph)
+                num_checks += 1
+        duckie_town.step(0.2)
+        for duckie in duckie_town.get_duckie_citizens():
+            # as at a control point, the new profile is only driven if its windows are free
+            duckie.reprofile = True
+            if duckie.start_move() and not duckie.replan:
+                assert_drives_own_windows(duckie, reservation_table, duckie_town.compact_graph)
+                num_checks += 1
+    assert num_checks > 40
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,69 @@
+# coding=utf-8
+import random
+import networkx as nx
+from comptests import comptest, run_module_tests
+from duckietown_uplan.algo.graph_search import DStarLite, get_distances_from
+from duckietown_uplan_tests.utils import get_town, get_planner, get_path_cost
+
+
+@comptest
+def test_incremental_planner_follows_occupancy_changes():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    reference_planner = get_planner(duckie_town)
+    incremental_planner = get_planner(duckie_town, mode='dstar_lite')
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(1)
+    for _ in range(10):
+        start, end = random_state.choice(node_names), random_state.choice(node_names)
+        occupancy = [random_state.choice(node_names) for _ in range(3)]
+        for _ in range(10):
+            reference_path = reference_planner.get_shortest_path(start, end, occupancy)
+            path = incremental_planner.get_shortest_path(start, end, occupancy)
+            assert len(path) == 0 if len(reference_path) == 0 else len(path) > 0
+            if len(path) == 0:
+                break
+            reference_cost = get_path_cost(graph, [start] + [node_name for node_name, _ in reference_path])
+            cost = get_path_cost(graph, [start] + [node_name for node_name, _ in path])
+            assert abs(cost - reference_cost) < 1e-9, (cost, reference_cost)
+            start = path[0][0]
+            occupancy[random_state.randrange(len(occupancy))] = random_state.choice(node_names)
+
+
+@comptest
+def test_incremental_paths_leave_zero_weight_cycles():
+    # nodes 1 and 2 are at the same pose, from 2 going back to 1 ties with going on to 3
+    successors = [[(1, 1.)], [(2, 0.)], [(1, 0.), (3, 1.)], []]
+    predecessors = [[], [(0, 1.), (2, 0.)], [(1, 0.)], [(2, 1.)]]
+    node_positions = [(0., 0.), (1., 0.), (1., 0.), (2., 0.)]
+    assert DStarLite(successors, predecessors, 0, 3, node_positions).get_path() == [0, 1, 2, 3]
+
+    random_state = random.Random(6)
+    for _ in range(50):
+        num_nodes = 12
+        node_positions = [(random_state.randint(0, 3), random_state.randint(0, 3)) for _ in range(num_nodes)]
+        successors = [[] for _ in range(num_nodes)]
+        predecessors = [[] for _ in range(num_nodes)]
+        for _ in range(30):
+            u, v = random_state.randrange(num_nodes), random_state.randrange(num_nodes)
+            if u == v or v in [successor for successor, _ in successors[u]]:
+                continue
+            # at least the straight line distance, 0 between nodes at the same position
+            (x_u, y_u), (x_v, y_v) = node_positions[u], node_positions[v]
+            weight = ((x_u - x_v) ** 2 + (y_u - y_v) ** 2) ** 0.5 * random_state.choice([1., 1., 2.])
+            successors[u].append((v, weight))
+            predecessors[v].append((u, weight))
+        start, end = random_state.randrange(num_nodes), random_state.randrange(num_nodes)
+        distance = get_distances_from(successors, start).get(end)
+        try:
+            path = DStarLite(successors, predecessors, start, end, node_positions).get_path()
+        except nx.NetworkXNoPath:
+            assert distance is None
+            continue
+        assert path[0] == start and path[-1] == end and len(set(path)) == len(path)
+        weights = [dict(successors[u])[v] for u, v in zip(path, path[1:])]
+        assert abs(sum(weights) - distance) < 1e-9
+
+
+if __name__ == '__main__':
+    run_module_tests()
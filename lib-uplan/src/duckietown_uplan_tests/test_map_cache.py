@@ -0,0 +1,52 @@
+# coding=utf-8
+import shutil
+import tempfile
+import numpy as np
+from comptests import comptest, run_module_tests
+import duckietown_world as dw
+from duckietown_uplan.environment.duckie_town import DuckieTown
+from duckietown_uplan.environment.map_cache import MapCache
+
+
+@comptest
+def test_map_cache_gives_same_town():
+    current_map = dw.load_map('4way')
+    cache_dir = tempfile.mkdtemp()
+    try:
+        map_cache = MapCache(cache_dir)
+        towns = []
+        for _ in range(2):
+            duckie_town = DuckieTown(current_map, map_cache=map_cache)
+            duckie_town.augment_graph()
+            towns.append(duckie_town)
+        built, loaded = towns
+        assert isinstance(loaded.foot_print_table.indices, np.memmap)
+        assert built.index_to_node == loaded.index_to_node
+        assert (built.collision_matrix != loaded.collision_matrix).nnz == 0
+        assert np.array_equal(built.foot_print_table.indptr, loaded.foot_print_table.indptr)
+        assert np.array_equal(built.foot_print_table.indices, loaded.foot_print_table.indices)
+        assert sorted(built.current_graph.edges(data='dist')) == sorted(loaded.current_graph.edges(data='dist'))
+        other_key = map_cache.get_key(loaded.map_digest, 'augmented', num_long=0, num_right=2, num_left=0,
+                                      lat_dist=0.3)
+        assert not map_cache.has(other_key)
+        key = map_cache.get_key(loaded.map_digest, 'augmented', num_long=0, num_right=1, num_left=0,
+                                lat_dist=0.3)
+        assert map_cache.has(key)
+        # as if duckietown_world had been upgraded since the entry was saved
+        version = dw.__version__
+        dw.__version__ = version + '.edited'
+        try:
+            assert map_cache.get_key(loaded.map_digest, 'augmented', num_long=0, num_right=1, num_left=0,
+                                     lat_dist=0.3) != key
+        finally:
+            dw.__version__ = version
+        # as if the preprocessing code had been edited since the entry was saved
+        map_cache.source_digest = 'edited'
+        assert not map_cache.has(map_cache.get_key(loaded.map_digest, 'augmented', num_long=0, num_right=1,
+                                                   num_left=0, lat_dist=0.3))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,77 @@
+# coding=utf-8
+import random
+import networkx as nx
+import numpy as np
+from scipy.sparse import identity
+from comptests import comptest, run_module_tests
+from duckietown_world.geo.transforms import SE2Transform
+from duckietown_uplan.algo.path_planning import PathPlanner
+from duckietown_uplan.environment.collision import get_colliding_indices
+from duckietown_uplan_tests.utils import get_town, get_planner, get_path_cost, get_path_node_names
+
+
+@comptest
+def test_planner_modes_give_shortest_paths():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    planners = [get_planner(duckie_town, mode=mode) for mode in PathPlanner.modes]
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(0)
+    for _ in range(50):
+        start, end = random_state.choice(node_names), random_state.choice(node_names)
+        occupancy = [random_state.choice(node_names) for _ in range(random_state.randint(0, 4))]
+        costs = []
+        for planner in planners:
+            path = planner.get_shortest_path(start, end, occupancy)
+            costs.append(None if len(path) == 0 else
+                         get_path_cost(graph, [start] + [node_name for node_name, _ in path]))
+        for cost in costs[1:]:
+            if costs[0] is None:
+                assert cost is None
+            else:
+                assert abs(cost - costs[0]) < 1e-9, costs
+
+
+def _get_lattice_planner(size=6):
+    """ Planner over a grid of unit edges going right and up, where most routes have equal length twins """
+    graph = nx.MultiDiGraph()
+    for x in range(size):
+        for y in range(size):
+            graph.add_node((x, y), point=SE2Transform([x, y], 0))
+    for x in range(size):
+        for y in range(size):
+            for neighbor in [(x + 1, y), (x, y + 1)]:
+                if neighbor in graph:
+                    graph.add_edge((x, y), neighbor, dist=1.)
+    index_to_node = dict(enumerate(graph.nodes()))
+    node_to_index = dict((node, index) for index, node in index_to_node.items())
+    # a node only collides with itself
+    return PathPlanner(graph, node_to_index=node_to_index, index_to_node=index_to_node,
+                       collision_matrix=identity(len(graph), dtype=int, format='csr'))
+
+
+@comptest
+def test_dijkstra_gives_networkx_paths():
+    duckie_town = get_town()
+    random_state = random.Random(1)
+    for planner in [get_planner(duckie_town), _get_lattice_planner()]:
+        graph = planner.graph
+        node_names = sorted(graph.nodes())
+        for _ in range(50):
+            start, end = random_state.choice(node_names), random_state.choice(node_names)
+            occupancy = [random_state.choice(node_names) for _ in range(random_state.randint(0, 4))]
+            # the search the planner used to run: networkx on a copy without the edges into the blocked nodes
+            masked_graph = graph.copy()
+            occupied_indices = np.array([planner.node_to_index[node_name] for node_name in occupancy], dtype=int)
+            for node_id in get_colliding_indices(planner.collision_matrix, occupied_indices):
+                blocked_node = planner.index_to_node[node_id]
+                masked_graph.remove_edges_from(list(masked_graph.in_edges(blocked_node, keys=True)))
+            try:
+                expected_path = nx.shortest_path(masked_graph, start, end, weight='dist')
+            except nx.NetworkXNoPath:
+                expected_path = [start]
+            assert get_path_node_names(start, planner.get_shortest_path(start, end, occupancy)) == expected_path
+
+
+if __name__ == '__main__':
+    run_module_tests()
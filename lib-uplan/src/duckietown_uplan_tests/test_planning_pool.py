@@ -0,0 +1,63 @@
+# coding=utf-8
+import random
+from comptests import comptest, run_module_tests
+from duckietown_uplan.algo.caching import LRUCache
+from duckietown_uplan.algo.observations import ObservationModel
+from duckietown_uplan.algo.planning_pool import PlanningPool
+from duckietown_uplan.algo.velocity_profiling import VelocityProfiler, vectorized_cost_function
+from duckietown_uplan_tests.utils import get_town, get_planner
+
+
+@vectorized_cost_function
+def slow_cost_function(delta_v_norm=0, delta_unc=0, unc=0, next_vel_norm=0, error_norm=0):
+    # picklable, so the workers can use it
+    return VelocityProfiler.cost_function(delta_v_norm, delta_unc, unc, next_vel_norm, error_norm) + \
+        10 * next_vel_norm
+
+
+@comptest
+def test_planning_pool_matches_local_planning():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(4)
+    observation_model = ObservationModel(graph)
+    observation_model.update_obstacles_uncertainity(dict((random_state.choice(node_names), 1) for _ in range(20)))
+    velocity_profiler = VelocityProfiler(0.1, 0.7, 10, profile_cache=LRUCache())
+    velocity_profiler.cost_function = slow_cost_function
+    requests = [(random_state.choice(node_names), random_state.choice(node_names),
+                 [random_state.choice(node_names)]) for _ in range(6)]
+    planning_pool = PlanningPool(duckie_town.path_planner, processes=2)
+    try:
+        results = planning_pool.plan([PlanningPool.get_request(start, end, occupancy, 0.25, velocity_profiler,
+                                                               observation_model)
+                                      for start, end, occupancy in requests])
+    finally:
+        planning_pool.close()
+    planner = get_planner(duckie_town)
+    default_profiler = VelocityProfiler(0.1, 0.7, 10)
+    num_slower_profiles = 0
+    for (start, end, occupancy), (path_node_names, velocity_profile) in zip(requests, results):
+        path = planner.get_shortest_path(start, end, occupancy)
+        assert path_node_names == [node_name for node_name, _ in path]
+        uncertainties = observation_model.get_path_uncertainities(path)
+        assert velocity_profile == velocity_profiler.get_velocity_profile(0.25, path, uncertainties)
+        # the cost function of the profiler was used, not the default one
+        if velocity_profile != default_profiler.get_velocity_profile(0.25, path, uncertainties):
+            num_slower_profiles += 1
+    assert num_slower_profiles > 0
+
+
+@comptest
+def test_town_closes_planning_pool():
+    with get_town() as duckie_town:
+        duckie_town.set_parallel_planning(processes=1)
+        planning_pool = duckie_town.planning_pool
+        assert planning_pool is not None
+    assert duckie_town.planning_pool is None
+    # the workers were stopped and joined
+    assert all(not process.is_alive() for process in planning_pool.pool._pool)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,30 @@
+# coding=utf-8
+from comptests import comptest, run_module_tests
+from duckietown_uplan.algo.caching import LRUCache
+from duckietown_uplan_tests.utils import get_town, get_planner
+
+
+@comptest
+def test_route_cache_hits_and_evictions():
+    route_cache = LRUCache(max_size=2)
+    route_cache.put('a', 1)
+    route_cache.put('b', 2)
+    assert route_cache.get('a') == 1
+    route_cache.put('c', 3)
+    assert 'b' not in route_cache and 'a' in route_cache
+    assert route_cache.get('b') is None
+    assert (route_cache.hits, route_cache.misses) == (1, 1)
+
+    duckie_town = get_town()
+    node_names = sorted(duckie_town.get_current_graph().nodes())
+    planner = get_planner(duckie_town, route_cache=LRUCache())
+    start, end, occupancy = node_names[0], node_names[-1], [node_names[len(node_names) // 2]]
+    path = planner.get_shortest_path(start, end, occupancy)
+    path.pop()
+    cached_path = planner.get_shortest_path(start, end, occupancy)
+    assert (planner.route_cache.hits, planner.route_cache.misses) == (1, 1)
+    assert len(cached_path) == len(path) + 1
+
+
+if __name__ == '__main__':
+    run_module_tests()
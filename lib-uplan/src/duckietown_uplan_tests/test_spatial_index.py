@@ -0,0 +1,49 @@
+# coding=utf-8
+import numpy as np
+from comptests import comptest, run_module_tests
+from duckietown_world.geo.transforms import SE2Transform
+from duckietown_uplan.environment.footprint_table import FootprintTable
+from duckietown_uplan.environment.spatial_index import NodeIndex
+from duckietown_uplan.environment.utils import get_closest_neighbor
+from duckietown_uplan_tests.utils import get_town
+
+
+@comptest
+def test_node_index_matches_linear_scan():
+    graph = get_town().get_current_graph()
+    node_index = NodeIndex(graph)
+    random_state = np.random.RandomState(0)
+    positions = node_index.positions
+    # the node positions themselves, shared by the nodes of different headings, and random points
+    locations = [position for position in positions[random_state.choice(len(positions), 50)]]
+    locations += [positions.min(axis=0) + random_state.rand(2) * (positions.max(axis=0) - positions.min(axis=0))
+                  for _ in range(50)]
+    for location in locations:
+        location_SE2 = SE2Transform(location, 0)
+        node_name, distance = node_index.get_closest_node(location_SE2)
+        expected_node_name, expected_distance = get_closest_neighbor(graph, location_SE2)
+        assert node_name == expected_node_name and abs(distance - expected_distance) < 1e-12
+        distances = np.linalg.norm(positions - location, axis=1)
+        k_closest = node_index.get_k_closest_nodes(location_SE2, 5)
+        assert np.allclose([k_distance for _, k_distance in k_closest], np.sort(distances)[:5])
+        assert all(abs(distances[node_index.node_to_index[k_node_name]] - k_distance) < 1e-12
+                   for k_node_name, k_distance in k_closest)
+
+
+@comptest
+def test_footprint_clusters_match_in_radius():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    foot_print_table = duckie_town.foot_print_table
+    positions = foot_print_table.node_index.positions
+    for radius in [foot_print_table.radius, 0.1, 0.3]:
+        table = foot_print_table if radius == foot_print_table.radius else \
+            FootprintTable(graph, radius, node_index=foot_print_table.node_index)
+        for node_name, position in zip(foot_print_table.node_index.node_names, positions):
+            # the nodes strictly closer than radius, like the old linear in_radius
+            in_radius = set(np.flatnonzero(np.linalg.norm(positions - position, axis=1) < radius))
+            assert set(table.get_cluster(node_name)) == in_radius
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,64 @@
+# coding=utf-8
+import random
+from comptests import comptest, run_module_tests
+from duckietown_uplan.algo.velocity_profiling import VelocityProfiler
+from duckietown_uplan_tests.utils import get_town, get_planner, get_path_cost
+
+
+@comptest
+def test_time_budget_gives_best_result_so_far():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    reference_planner = get_planner(duckie_town)
+    hurried_planner = get_planner(duckie_town, time_budget=0.)
+    patient_planner = get_planner(duckie_town, time_budget=60.)
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(5)
+    for _ in range(20):
+        start, end = random_state.choice(node_names), random_state.choice(node_names)
+        reference_path = reference_planner.get_shortest_path(start, end)
+        if len(reference_path) == 0:
+            continue
+        reference_cost = get_path_cost(graph, [start] + [node_name for node_name, _ in reference_path])
+        hurried_path = hurried_planner.get_shortest_path(start, end)
+        assert hurried_path[-1][0] == end
+        assert get_path_cost(graph, [start] + [node_name for node_name, _ in hurried_path]) >= reference_cost - 1e-9
+        patient_path = patient_planner.get_shortest_path(start, end)
+        assert patient_planner.is_last_path_optimal
+        assert abs(get_path_cost(graph, [start] + [node_name for node_name, _ in patient_path]) -
+                   reference_cost) < 1e-9
+
+    path = reference_planner.get_shortest_path(node_names[0], node_names[-1])
+    uncertainties = [random_state.random() for _ in path]
+    reference_profile = VelocityProfiler(0.1, 0.7, 10).get_velocity_profile(0.25, path, uncertainties)
+    hurried_profiler = VelocityProfiler(0.1, 0.7, 10, time_budget=0.)
+    assert len(hurried_profiler.get_velocity_profile(0.25, path, uncertainties)) == len(reference_profile)
+    assert not hurried_profiler.is_last_profile_optimal
+    patient_profiler = VelocityProfiler(0.1, 0.7, 10, time_budget=60.)
+    assert patient_profiler.get_velocity_profile(0.25, path, uncertainties) == reference_profile
+    assert patient_profiler.is_last_profile_optimal
+
+
+@comptest
+def test_time_budget_applies_to_batches():
+    duckie_town = get_town()
+    graph = duckie_town.get_current_graph()
+    node_names = sorted(graph.nodes())
+    random_state = random.Random(6)
+    requests = [(random_state.choice(node_names), random_state.choice(node_names), []) for _ in range(20)]
+    # with no time at all every search stops at its first (weighted A*) path
+    hurried_planner = get_planner(duckie_town, time_budget=0.)
+    hurried_paths = hurried_planner.get_shortest_paths(requests)
+    assert hurried_paths == [hurried_planner.get_shortest_path(start, end) for start, end, _ in requests]
+    patient_planner = get_planner(duckie_town, time_budget=60.)
+    patient_paths = patient_planner.get_shortest_paths(requests)
+    assert patient_planner.is_last_path_optimal
+    for (start, end, _), path, reference_path in zip(requests, patient_paths,
+                                                    get_planner(duckie_town).get_shortest_paths(requests)):
+        assert len(path) == len(reference_path) == 0 or abs(
+            get_path_cost(graph, [start] + [node_name for node_name, _ in path]) -
+            get_path_cost(graph, [start] + [node_name for node_name, _ in reference_path])) < 1e-9
+
+
+if __name__ == '__main__':
+    run_module_tests()
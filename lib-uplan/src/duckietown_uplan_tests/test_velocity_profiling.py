@@ -0,0 +1,154 @@
+# coding=utf-8
+import itertools
+import random
+import numpy as np
+from comptests import comptest, run_module_tests
+from duckietown_uplan.algo.velocity_profiling import VelocityProfiler, vectorized_cost_function, \
+    get_receding_horizon_profile
+from duckietown_uplan.algo.caching import LRUCache
+
+
+def _get_profile_cost(velocity_profiler, vel_ids):
+    return sum(cost_matrix[from_vel_id, to_vel_id] for cost_matrix, from_vel_id, to_vel_id
+               in zip(velocity_profiler.cost_matrices, vel_ids, vel_ids[1:]))
+
+
+@comptest
+def test_velocity_profiles_are_the_cheapest():
+    random_state = random.Random(0)
+    for _ in range(10):
+        path = [('node%d' % i, {}) for i in range(random_state.randint(1, 4))]
+        uncertainties = [random_state.random() for _ in path]
+        velocity_profiler = VelocityProfiler(0.1, 0.7, 4)
+        velocity_profile = velocity_profiler.get_velocity_profile(0.25, path, uncertainties)
+        assert len(velocity_profile) == len(path) + 1
+        id_start = int(np.abs(velocity_profiler.vel_space - 0.25).argmin())
+        # every sequence of velocities starting from the start one
+        for end_vel_id, (cost, min_path) in enumerate(velocity_profiler.path_history):
+            assert min_path[0][1] == id_start and min_path[-1][1] == end_vel_id
+            costs = [_get_profile_cost(velocity_profiler, (id_start,) + vel_ids + (end_vel_id,))
+                     for vel_ids in itertools.product(velocity_profiler.vel_ids, repeat=len(path) - 1)]
+            assert abs(cost - min(costs)) < 1e-9
+            assert cost == velocity_profiler.get_path_cost(min_path)[0]
+            trajectory_cost, trajectory = velocity_profiler.trajectory_history[end_vel_id]
+            assert trajectory_cost == cost and trajectory == velocity_profiler.get_trajectory_from_path(min_path)
+        assert abs(min(cost for cost, _ in velocity_profiler.path_history) - sum(velocity_profiler.cost_array)) < 1e-9
+
+
+@comptest
+def test_scalar_and_vectorized_cost_functions_agree():
+    def scalar_cost_function(delta_v_norm=0, delta_unc=0, unc=0, next_vel_norm=0, error_norm=0):
+        return delta_v_norm ** 2 + delta_unc + 2 * next_vel_norm * unc + error_norm ** 2
+
+    @vectorized_cost_function
+    def array_cost_function(delta_v_norm=0, delta_unc=0, unc=0, next_vel_norm=0, error_norm=0):
+        return delta_v_norm ** 2 + delta_unc + 2 * next_vel_norm * unc + error_norm ** 2
+
+    random_state = random.Random(1)
+    path = [('node%d' % i, {}) for i in range(15)]
+    uncertainties = [random_state.random() for _ in path]
+    profiles = []
+    for cost_function in [scalar_cost_function, array_cost_function]:
+        velocity_profiler = VelocityProfiler(0.1, 0.7, 6)
+        profiles.append(velocity_profiler.get_velocity_profile(0.25, path, uncertainties,
+                                                               cost_function=cost_function))
+        assert velocity_profiler.cost_matrices.shape == (len(path), 6, 6)
+    assert profiles[0] == profiles[1]
+
+
+@comptest
+def test_velocity_profiles_reuse_the_path_suffix():
+    random_state = random.Random(2)
+    path = [('node%d' % i, {}) for i in range(30)]
+    uncertainties = [random_state.random() for _ in path]
+    velocity_profiler = VelocityProfiler(0.1, 0.7, 10)
+    velocity_profiler.get_velocity_profile(0.25, path, uncertainties)
+    assert velocity_profiler.tables.num_computed_layers == len(path)
+    for k in range(1, 10):
+        if k == 5:
+            # a changed uncertainty, the layers before it are computed again
+            uncertainties[12] = 1.
+        velocity_profile = velocity_profiler.get_velocity_profile(0.4, path[k:], uncertainties[k:])
+        assert velocity_profiler.tables.num_computed_layers == (12 - k + 2 if k == 5 else 1)
+        assert velocity_profile == VelocityProfiler(0.1, 0.7, 10).get_velocity_profile(0.4, path[k:],
+                                                                                       uncertainties[k:])
+
+
+@comptest
+def test_horizon_profiles_are_extended():
+    random_state = random.Random(3)
+    path = [('node%d' % i, {}) for i in range(12)]
+    uncertainties = [random_state.random() for _ in path]
+    full_profile = VelocityProfiler(0.1, 0.7, 10).get_velocity_profile(0.25, path, uncertainties)
+    assert VelocityProfiler(0.1, 0.7, 10, horizon=12).get_velocity_profile(0.25, path, uncertainties) == full_profile
+    velocity_profiler = VelocityProfiler(0.1, 0.7, 10, horizon=4)
+    velocity_profile = velocity_profiler.get_velocity_profile(0.25, path, uncertainties)
+    assert velocity_profiler.num_profiled_velocities == 5 and len(velocity_profiler.tables) == 5
+    assert velocity_profile[5:] == [velocity_profile[4]] * (len(path) - 4)
+    # driving along a longer path, profiled again where the optimized velocities run out
+    path = [('node%d' % i, {}) for i in range(30)]
+    uncertainties = np.clip(0.5 + np.cumsum([random_state.gauss(0, 0.1) for _ in path]), 0, 1).tolist()
+    full_profiler = VelocityProfiler(0.1, 0.7, 10)
+    full_profiler.get_velocity_profile(0.25, path, uncertainties)
+    vel_space = np.linspace(0.1, 0.7, 10)
+    for horizon in [1, 4]:
+        velocities, num_profiles = get_receding_horizon_profile(VelocityProfiler(0.1, 0.7, 10, horizon=horizon),
+                                                                0.25, path, uncertainties)
+        assert len(velocities) == len(path) + 1 and num_profiles >= len(uncertainties) // horizon
+        vel_ids = [int(np.abs(vel_space - velocity).argmin()) for velocity in velocities]
+        assert _get_profile_cost(full_profiler, vel_ids) >= sum(full_profiler.cost_array) - 1e-9
+
+
+@comptest
+def test_velocity_changes_stay_in_the_band():
+    random_state = random.Random(4)
+    for _ in range(10):
+        path = [('node%d' % i, {}) for i in range(random_state.randint(1, 4))]
+        uncertainties = [random_state.random() for _ in path]
+        velocity_profiler = VelocityProfiler(0.1, 0.7, 7, max_velocity_change=0.1)
+        velocity_profile = velocity_profiler.get_velocity_profile(0.25, path, uncertainties)
+        assert velocity_profiler.tables.band_width == 1
+        assert all(abs(velocity - next_velocity) <= 0.1 + 1e-9
+                   for velocity, next_velocity in zip(velocity_profile, velocity_profile[1:]))
+        id_start = int(np.abs(velocity_profiler.vel_space - 0.25).argmin())
+        # the velocity changes out of the band cost inf
+        costs = [_get_profile_cost(velocity_profiler, (id_start,) + vel_ids)
+                 for vel_ids in itertools.product(velocity_profiler.vel_ids, repeat=len(path))]
+        assert abs(sum(velocity_profiler.cost_array) - min(costs)) < 1e-9
+        # a band reaching every velocity is the whole graph
+        wide_velocity_profiler = VelocityProfiler(0.1, 0.7, 7, max_velocity_change=0.6)
+        assert wide_velocity_profiler.get_velocity_profile(0.25, path, uncertainties) == \
+            VelocityProfiler(0.1, 0.7, 7).get_velocity_profile(0.25, path, uncertainties)
+        assert wide_velocity_profiler.tables.band_width is None
+
+
+@comptest
+def test_profiles_of_quantized_uncertainties_are_cached():
+    profile_cache = LRUCache(max_size=8)
+    path = [('node%d' % i, {}) for i in range(10)]
+    uncertainties = [0.2] * len(path)
+    velocity_profile = VelocityProfiler(0.1, 0.7, 10, profile_cache=profile_cache).get_velocity_profile(
+        0.25, path, uncertainties)
+    velocity_profile.pop(0)
+    velocity_profiler = VelocityProfiler(0.1, 0.7, 10, profile_cache=profile_cache)
+    cached_velocity_profile = velocity_profiler.get_velocity_profile(0.26, path, [0.201] + uncertainties[1:])
+    assert profile_cache.get_stats()['hits'] == 1
+    reference_profiler = VelocityProfiler(0.1, 0.7, 10)
+    assert cached_velocity_profile == reference_profiler.get_velocity_profile(0.25, path, uncertainties)
+    # the state is the one of the cached profile, its tables are built again when read
+    assert velocity_profiler.uncertainties == reference_profiler.uncertainties
+    assert np.array_equal(velocity_profiler.vel_space, reference_profiler.vel_space)
+    assert list(velocity_profiler.path_ids) == list(reference_profiler.path_ids)
+    assert velocity_profiler.cost_array == reference_profiler.cost_array
+    assert np.array_equal(velocity_profiler.cost_matrices, reference_profiler.cost_matrices)
+    assert velocity_profiler.path_history == reference_profiler.path_history
+    assert velocity_profiler.trajectory_history == reference_profiler.trajectory_history
+    # another start velocity bin, path length or quantized uncertainty is another profile
+    velocity_profiler.get_velocity_profile(0.7, path, uncertainties)
+    velocity_profiler.get_velocity_profile(0.25, path[1:], uncertainties[1:])
+    velocity_profiler.get_velocity_profile(0.25, path, [0.25] + uncertainties[1:])
+    assert profile_cache.get_stats()['misses'] == 4 and len(profile_cache) == 4
+
+
+if __name__ == '__main__':
+    run_module_tests()
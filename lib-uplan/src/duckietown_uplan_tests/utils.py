@@ -0,0 +1,37 @@
+# coding=utf-8
+import duckietown_world as dw
+from duckietown_uplan.environment.duckie_town import DuckieTown
+from duckietown_uplan.algo.path_planning import PathPlanner
+
+# map name -> augmented DuckieTown shared by the tests of a process
+_towns = {}
+
+
+def get_town(map_name='4way'):
+    """ Returns the augmented DuckieTown of map_name, built once. The tests share it so they must
+    leave it as they found it (planner mode, duckies, ...)
+    """
+    duckie_town = _towns.get(map_name)
+    if duckie_town is None:
+        duckie_town = DuckieTown(dw.load_map(map_name))
+        duckie_town.augment_graph()
+        _towns[map_name] = duckie_town
+    return duckie_town
+
+
+def get_planner(duckie_town, **kwargs):
+    """ New PathPlanner on the graph and the collision matrix of duckie_town """
+    kwargs.setdefault('compact_graph', duckie_town.compact_graph)
+    return PathPlanner(duckie_town.get_current_graph(), node_to_index=duckie_town.node_to_index,
+                       index_to_node=duckie_town.index_to_node,
+                       collision_matrix=duckie_town.collision_matrix, **kwargs)
+
+
+def get_path_cost(graph, path_node_names):
+    return sum(min(attr['dist'] for attr in graph[u][v].values())
+               for u, v in zip(path_node_names, path_node_names[1:]))
+
+
+def get_path_node_names(start, path):
+    """ Node names of a planned path, start included """
+    return [start] + [node_name for node_name, _ in path]
@@ -16,6 +16,7 @@ from uplan_visualization.msg import duckieStruct
 import duckietown_world as dw
 import duckietown_uplan
 from duckietown_uplan.environment.duckie_town import DuckieTown
+from duckietown_uplan.environment.map_cache import MapCache
 
 duckieMsg1 = duckieData()
 trac1 = geometry_msgs.msg.Pose2D()
@@ -33,8 +34,10 @@ duckieVec.duckie_data = [duckieMsg]
 
 current_map = dw.load_map('4way')
 number_of_duckies = 5
-duckie_town = DuckieTown(current_map)
+duckie_town = DuckieTown(current_map, map_cache=MapCache())
 duckie_town.augment_graph()
+# the replans must fit in the 20 ms tick of the publishing loop
+duckie_town.set_planning_time_budget(path_time_budget=0.004, profile_time_budget=0.008)
 #duckie_town.render_current_graph()
 duckie_town.spawn_random_duckie(number_of_duckies)
 duckie_town.reset()